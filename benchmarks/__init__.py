@@ -0,0 +1,6 @@
+"""Benchmarks of ffi-navigator on synthetic repositories.
+
+Run from the repository root with the package on the path, e.g.
+
+    PYTHONPATH=python python -m benchmarks.scaling --dialect tvm --files 1000 10000
+"""
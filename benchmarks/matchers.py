@@ -0,0 +1,296 @@
+"""Micro-benchmark of the matcher factories of pattern.py.
+
+Every matcher runs on generated corpora: dense registrations, a long
+generated file, very long lines and sources without any match. The
+throughput is reported in MB/s and matches/s, the best of a few runs
+that each take at least min_time. The line index of the source buffer
+is built before the timing, the same as in the indexing where one
+buffer is shared by all the matchers of a file.
+
+The throughput only compares on the same machine, record a baseline
+before a change and compare with it after the change. The recorded
+baseline of the repository also checks the number of matches.
+
+Example
+-------
+    PYTHONPATH=python python -m benchmarks.matchers --save /tmp/before.json
+    # apply the change
+    PYTHONPATH=python python -m benchmarks.matchers --compare /tmp/before.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+from ffi_navigator import pattern
+
+# Baseline recorded with the default options.
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "matchers_baseline.json")
+
+
+def _dense_cc(scale):
+    lines = ["#include <tvm/runtime/registry.h>\n", "\n", "namespace tvm {\n"]
+    for i in range(2000 * scale):
+        lines += ["TVM_REGISTER_GLOBAL(\"relay.op.Func%d\")\n" % i,
+                  ".set_body_typed([](Expr x) { return MakeOp%d(x); });\n" % i,
+                  "REGISTER_MAKE(Node%d);\n" % i,
+                  "auto f%d = runtime::Registry::Get(\"relay.op.Func%d\");\n" % (i, i),
+                  "m.def(\"func_%d\", &Func%d)\n" % (i, i),
+                  ".def(\"method_%d\", [](Node* n) {\n" % i,
+                  "  return n->value;\n",
+                  "});\n",
+                  "\n"]
+    return "".join(lines + ["}  // namespace tvm\n"])
+
+
+def _generated_cc(scale):
+    # in the style of the generated python bindings of torch
+    lines = ["static PyMethodDef torch_functions[] = {\n"]
+    for i in range(15000 * scale):
+        lines.append("  {\"op_%d\", (PyCFunction)(void(*)(void))THPVariable_op_%d, "
+                     "METH_VARARGS | METH_KEYWORDS | METH_STATIC, NULL},\n" % (i, i))
+    lines.append("};\n")
+    for i in range(15000 * scale):
+        lines.append("      .def(\"op_%d\", &op_%d, py::arg(\"self\"), py::arg(\"other\"))\n"
+                     % (i, i))
+    return "".join(lines)
+
+
+def _long_lines_cc(scale):
+    # e.g. embedded data or minified code, a few matches on each line
+    lines = []
+    for i in range(16 * scale):
+        items = ["{%d, \"value_%d\", &table[%d]}" % (j, j, j) for j in range(8000)]
+        items[4000] = "m.def(\"long_%d\", &f)" % i
+        lines.append("static const Entry entries_%d[] = {%s};\n" % (i, ", ".join(items)))
+    return "".join(lines)
+
+
+def _no_match_cc(scale):
+    lines = []
+    for i in range(20000 * scale):
+        lines += ["int compute_%d(const std::vector<int>& x) {\n" % i,
+                  "  int sum = 0;\n",
+                  "  for (int v : x) sum += v * %d;\n" % i,
+                  "  return sum;\n",
+                  "}\n"]
+    return "".join(lines)
+
+
+def _dense_py(scale):
+    lines = ["from __future__ import absolute_import\n",
+             "from .._ffi.function import _init_api, register_func\n",
+             "from . import _ffi_api, _make as make\n",
+             "\n"]
+    for i in range(2000 * scale):
+        lines += ["@register_func(\"relay.backend.func_%d\")\n" % i,
+                  "def func_%d(x):\n" % i,
+                  "    return _ffi_api.Func%d(make.Node%d(x), torch._C._nn.op_%d(x))\n" % (i, i, i),
+                  "\n",
+                  "\n"]
+    return "".join(lines + ["_init_api(\"relay.backend\", __name__)\n"])
+
+
+def _long_lines_py(scale):
+    lines = ["from . import _ffi_api\n"]
+    for i in range(16 * scale):
+        items = ["_ffi_api.Func%d(x%d)" % (j, j) for j in range(8000)]
+        lines.append("table_%d = [%s]\n" % (i, ", ".join(items)))
+    return "".join(lines)
+
+
+def _no_match_py(scale):
+    lines = []
+    for i in range(20000 * scale):
+        lines += ["def compute_%d(values):\n" % i,
+                  "    total = 0\n",
+                  "    for value in values:\n",
+                  "        total += value * %d\n" % i,
+                  "    return total\n",
+                  "\n"]
+    return "".join(lines)
+
+
+CORPORA = {
+    "dense_cc": _dense_cc,
+    "generated_cc": _generated_cc,
+    "long_lines_cc": _long_lines_cc,
+    "no_match_cc": _no_match_cc,
+    "dense_py": _dense_py,
+    "long_lines_py": _long_lines_py,
+    "no_match_py": _no_match_py,
+}
+
+
+def _create(*args):
+    return args
+
+
+def _matcher_case(matcher, path):
+    return lambda source: len(matcher(path, source))
+
+
+def _cases():
+    """The benchmark cases, map from name to (corpora, function(source) -> num matches)."""
+    cc = [x for x in CORPORA if x.endswith("_cc")]
+    py = [x for x in CORPORA if x.endswith("_py")]
+    return {
+        "re_matcher": (cc, _matcher_case(pattern.re_matcher(
+            r"\s*(REGISTER_MAKE|REGISTER_MAKE_BINARY_OP)\((?P<key>[A-Za-z0-9]+)",
+            _create, literals=["REGISTER_MAKE"]), "bench.cc")),
+        "re_matcher_search": (py, _matcher_case(pattern.re_matcher(
+            r"(torch)?\.([A-Za-z0-9|_]+\.)*(?P<key>[A-Za-z0-9|_|]+)",
+            _create, use_search=True, literals=["."]), "bench.py")),
+        "re_multi_line_matcher": (cc, _matcher_case(
+            pattern.re_match_pybind_method(), "bench.cc")),
+        "macro_matcher": (cc, _matcher_case(pattern.macro_matcher(
+            ["TVM_REGISTER_API", "TVM_REGISTER_GLOBAL"], _create), "bench.cc")),
+        "def_matcher": (cc, _matcher_case(pattern.def_matcher(
+            ["def", "def_packed", "def_method"], _create), "bench.cc")),
+        "func_get_searcher": (cc, _matcher_case(pattern.func_get_searcher(
+            ["GetPackedFunc", "runtime::Registry::Get"], _create), "bench.cc")),
+        "decorator_matcher": (py, _matcher_case(pattern.decorator_matcher(
+            ["register_func"], "def", _create), "bench.py")),
+        "search_symbol": (py, lambda source: len(pattern.search_symbol(
+            source, ["_ffi_api.Func7", "make.Node7"]))),
+        "find_py_imports": (py, lambda source: len(pattern.find_py_imports(source))),
+        "find_py_names": (py, lambda source: len(pattern.find_py_names(
+            source, {"_ffi_api", "make"}))),
+    }
+
+
+def _timeit(fbench, source, number):
+    # same as timeit, the garbage collection is not timed
+    gc.collect()
+    gc.disable()
+    try:
+        tstart = time.perf_counter()
+        for _ in range(number):
+            fbench(source)
+        return time.perf_counter() - tstart
+    finally:
+        gc.enable()
+
+
+def run(scale=1, repeat=5, min_time=0.05, name_filter=None):
+    """Run the benchmark cases.
+
+    Parameters
+    ----------
+    scale : int
+        Multiplier of the corpus sizes.
+
+    repeat : int
+        Number of runs of each case, the fastest one is reported.
+
+    min_time : float
+        Minimum seconds of a run, a run repeats the case as many times as needed.
+
+    name_filter : Optional[str]
+        Only run the cases whose "matcher/corpus" name contains it.
+
+    Returns
+    -------
+    results : dict of str to dict
+        Map from "matcher/corpus" to the size, the matches and the throughput.
+    """
+    texts = {}
+    results = {}
+    for matcher, (corpora, fbench) in _cases().items():
+        for corpus in corpora:
+            name = "%s/%s" % (matcher, corpus)
+            if name_filter and name_filter not in name:
+                continue
+            if corpus not in texts:
+                texts[corpus] = CORPORA[corpus](scale)
+            text = texts[corpus]
+            source = pattern.SourceBuffer(text)
+            source.line_starts
+            matches = fbench(source)
+            number = 1
+            while _timeit(fbench, source, number) < min_time:
+                number *= 2
+            best = min(_timeit(fbench, source, number) for _ in range(repeat)) / number
+            size = len(text.encode("utf-8"))
+            results[name] = {"bytes": size, "matches": matches, "secs": best,
+                             "mb_per_sec": size / best / 1e6,
+                             "matches_per_sec": matches / best}
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Compare the results with a baseline.
+
+    Returns
+    -------
+    report : list of (str, float, str)
+        The case name, the throughput relative to the baseline and
+        "regression", "mismatch" (different number of matches), "new" or "".
+    """
+    report = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base is None:
+            report.append((name, 1.0, "new"))
+            continue
+        ratio = value["mb_per_sec"] / base["mb_per_sec"]
+        if value["matches"] != base["matches"]:
+            status = "mismatch"
+        elif ratio < 1 - tolerance:
+            status = "regression"
+        else:
+            status = ""
+        report.append((name, ratio, status))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=int, default=1, help="Multiplier of the corpus sizes.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each case.")
+    parser.add_argument("--min-time", type=float, default=0.05,
+                        help="Minimum seconds of each run.")
+    parser.add_argument("--filter", default=None, help="Only run the matching cases.")
+    parser.add_argument("--compare", nargs="?", const=BASELINE, default=None,
+                        help="Compare with a baseline, the recorded one by default.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Relative slowdown reported as a regression.")
+    parser.add_argument("--save", default=None, help="Save the results as a baseline.")
+    parser.add_argument("--note", default=None, help="A remark saved with the baseline.")
+    args = parser.parse_args()
+
+    results = run(args.scale, args.repeat, args.min_time, args.filter)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fi:
+            baseline = json.load(fi)
+        if baseline["meta"]["scale"] != args.scale:
+            parser.error("the baseline is recorded with --scale %d" % baseline["meta"]["scale"])
+        report = {name: (ratio, status) for name, ratio, status
+                  in compare(results, baseline["results"], args.tolerance)}
+    for name, value in results.items():
+        line = "%-40s %8.1f MB/s %12.0f matches/s %8d matches" % (
+            name, value["mb_per_sec"], value["matches_per_sec"], value["matches"])
+        if baseline is not None:
+            ratio, status = report[name]
+            line += "  x%.2f %s" % (ratio, status)
+        print(line)
+
+    if args.save:
+        meta = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "scale": args.scale}
+        if args.note:
+            meta["note"] = args.note
+        with open(args.save, "w") as fo:
+            json.dump({"meta": meta, "results": results}, fo, indent=2, sort_keys=True)
+    if baseline is not None and any(status in ("regression", "mismatch")
+                                    for _, status in report.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
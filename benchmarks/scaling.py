@@ -0,0 +1,201 @@
+"""Scaling benchmark of the indexing and the queries on synthetic repositories.
+
+Every repository is indexed in a fresh process without the index cache,
+so the index time and the peak RSS are those of a cold start.
+The results are written as JSON, one record per dialect and size.
+
+Example
+-------
+    PYTHONPATH=python python -m benchmarks.scaling --dialect tvm torch \\
+        --files 1000 10000 100000 --work-dir /tmp/synth --output scaling.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import attr
+from .synth import DIALECTS, SynthConfig, generate_repo, load_repo
+
+
+def _peak_rss(children=False):
+    """Peak resident set size in bytes, None if it is not available."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # kilobytes on linux, bytes on macos
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+
+def measure(root, num_workers=None, budget=None):
+    """Index a generated repository and time the queries of its sampled call sites.
+
+    The definition query is the one the language server runs for the symbol
+    under the cursor: find_defs for python symbols, the definitions of the key
+    for the dialects that extract a reference at the call site.
+
+    Parameters
+    ----------
+    root : str
+        The root of a repository created by generate_repo.
+
+    num_workers : Optional[int]
+        Number of extraction processes of the workspace.
+
+    budget : Optional[float]
+        Seconds to spend on the queries, the remaining call sites
+        are not queried once it runs out.
+
+    Returns
+    -------
+    result : dict
+        The measurements, latencies are in milliseconds.
+    """
+    from ffi_navigator import workspace, pattern
+    from ffi_navigator.lsp import Position
+    from ffi_navigator.query import LatencyStats
+
+    repo = load_repo(root)
+    ws = workspace.Workspace(num_workers=num_workers)
+    tstart = time.perf_counter()
+    ws.initialize(root)
+    index_secs = time.perf_counter() - tstart
+
+    latency = LatencyStats(max_samples=len(repo.samples))
+    misses = 0
+    num_queries = 0
+    deadline = time.perf_counter() + budget if budget is not None else None
+    for site in repo.samples:
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+        num_queries += 1
+        path = os.path.join(root, site.path)
+        with open(path) as fi:
+            source = pattern.SourceBuffer(fi.read())
+        tstart = time.perf_counter()
+        sym = ws.extract_symbol(path, source, Position(site.line, site.character))
+        tdefs = time.perf_counter()
+        if isinstance(sym, pattern.Symbol):
+            defs = ws.find_defs(path, sym.value)
+        else:
+            defs = ws.snapshot.key2defs.get(sym.key, []) if sym is not None else []
+        trefs = time.perf_counter()
+        refs = ws.find_refs(site.key)
+        tend = time.perf_counter()
+        latency.record("extract_symbol", tdefs - tstart)
+        latency.record("find_defs", trefs - tdefs)
+        latency.record("find_refs", tend - trefs)
+        if [x.key for x in defs] != [site.key] or not refs:
+            misses += 1
+
+    stats = ws.stats()
+    return {
+        "files": stats["files"],
+        "index_secs": index_secs,
+        "files_per_sec": stats["files"] / index_secs if index_secs > 0 else 0.0,
+        "peak_rss": _peak_rss(),
+        "peak_rss_workers": _peak_rss(children=True),
+        "index_memory": sum(stats["memory"].values()),
+        "memory": stats["memory"],
+        "counts": stats["counts"],
+        "queries": num_queries,
+        "misses": misses,
+        "latency": latency.summary(),
+    }
+
+
+def _run_measure(root, num_workers, budget):
+    """Run measure in a fresh process."""
+    cmd = [sys.executable, "-m", "benchmarks.scaling", "--measure", root,
+           "--query-budget", str(budget)]
+    if num_workers is not None:
+        cmd += ["--workers", str(num_workers)]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, check=True,
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(proc.stdout.decode("utf-8"))
+
+
+def _summary(record):
+    latency = record["latency"]
+    return ("%-7s %7d files: index %7.2fs %7.0f files/s, rss %6.1f MB, index %6.1f MB, "
+            "p50/p99 ms symbol %.3f/%.3f defs %.3f/%.3f refs %.3f/%.3f, %d/%d misses" % (
+                record["config"]["dialect"], record["files"], record["index_secs"],
+                record["files_per_sec"], (record["peak_rss"] or 0) / 1e6,
+                record["index_memory"] / 1e6,
+                latency["extract_symbol"]["p50"], latency["extract_symbol"]["p99"],
+                latency["find_defs"]["p50"], latency["find_defs"]["p99"],
+                latency["find_refs"]["p50"], latency["find_refs"]["p99"], record["misses"],
+                record["queries"]))
+
+
+def main():
+    default = SynthConfig()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dialect", nargs="+", default=DIALECTS, choices=DIALECTS)
+    parser.add_argument("--files", nargs="+", type=int, default=[1000, 10000],
+                        help="Numbers of source files of the repositories.")
+    parser.add_argument("--defs-per-file", type=int, default=default.defs_per_file,
+                        help="FFI registrations per C++ file.")
+    parser.add_argument("--calls-per-file", type=int, default=default.calls_per_file,
+                        help="FFI call sites per python file.")
+    parser.add_argument("--filler-lines", type=int, default=default.filler_lines,
+                        help="Lines without FFI patterns after each registration and call.")
+    parser.add_argument("--queries", type=int, default=default.num_samples,
+                        help="Number of call sites to query.")
+    parser.add_argument("--query-budget", type=float, default=60.0,
+                        help="Seconds to spend on the queries of each repository.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of extraction processes, the number of CPUs by default.")
+    parser.add_argument("--work-dir", default=None,
+                        help="Directory to keep the generated repositories for later runs.")
+    parser.add_argument("--output", default=None, help="The JSON result file.")
+    parser.add_argument("--measure", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        json.dump(measure(args.measure, args.workers, args.query_budget), sys.stdout)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir if args.work_dir else tmp_dir
+        results = []
+        for dialect in args.dialect:
+            for num_files in args.files:
+                config = SynthConfig(
+                    dialect=dialect, num_files=num_files, defs_per_file=args.defs_per_file,
+                    calls_per_file=args.calls_per_file, filler_lines=args.filler_lines,
+                    num_samples=args.queries)
+                root = os.path.join(work_dir, "%s-%d-%d-%d-%d-%d" % (
+                    dialect, num_files, config.defs_per_file, config.calls_per_file,
+                    config.filler_lines, config.num_samples))
+                repo = generate_repo(root, config)
+                record = {"config": attr.asdict(config), "num_defs": repo.num_defs,
+                          "num_calls": repo.num_calls}
+                record.update(_run_measure(root, args.workers, args.query_budget))
+                results.append(record)
+                print(_summary(record), file=sys.stderr)
+
+    output = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "workers": args.workers,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fo:
+            json.dump(output, fo, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""Generator of synthetic repositories in the layout of the supported dialects.
+
+The C++ files register FFI functions and the python files call them,
+the call sites of a python file go to the functions registered in the
+same module, so every call site resolves to exactly one definition.
+"""
+import json
+import os
+import random
+import attr
+
+DIALECTS = ["tvm", "torch", "dgl", "mxnet", "taichi"]
+# Name of the file that records the config and the sampled call sites.
+MANIFEST = "synth.json"
+
+
+@attr.s
+class SynthConfig:
+    """Shape of a synthetic repository.
+
+    Parameters
+    ----------
+    dialect : str
+        The dialect to generate, one of DIALECTS.
+
+    num_files : int
+        Number of C++ and python source files.
+
+    defs_per_file : int
+        Number of FFI registrations in each C++ file.
+
+    calls_per_file : int
+        Number of FFI call sites in each python file.
+
+    filler_lines : int
+        Number of lines without FFI patterns after each registration and call site.
+
+    py_ratio : float
+        Fraction of the source files that are python files.
+
+    files_per_module : int
+        Number of C++ files of each module.
+
+    num_samples : int
+        Number of call sites recorded in the manifest for the queries.
+
+    seed : int
+        Seed of the random choice of the called functions.
+    """
+    dialect : str = attr.ib(default="tvm")
+    num_files : int = attr.ib(default=1000)
+    defs_per_file : int = attr.ib(default=8)
+    calls_per_file : int = attr.ib(default=8)
+    filler_lines : int = attr.ib(default=4)
+    py_ratio : float = attr.ib(default=0.5)
+    files_per_module : int = attr.ib(default=16)
+    num_samples : int = attr.ib(default=1000)
+    seed : int = attr.ib(default=0)
+
+
+@attr.s
+class CallSite:
+    """A call of an FFI function in a python file.
+
+    Parameters
+    ----------
+    key : str
+        The key of the called function.
+
+    path : str
+        The path of the python file relative to the repository root.
+
+    line : int
+        The line of the call.
+
+    character : int
+        The start of the called symbol.
+    """
+    key : str = attr.ib()
+    path : str = attr.ib()
+    line : int = attr.ib()
+    character : int = attr.ib()
+
+
+@attr.s
+class SynthRepo:
+    """A generated repository.
+
+    Parameters
+    ----------
+    root : str
+        The root directory.
+
+    config : SynthConfig
+        The config it is generated from.
+
+    num_defs : int
+        Number of FFI registrations.
+
+    num_calls : int
+        Number of FFI call sites.
+
+    samples : list of CallSite
+        Randomly sampled call sites.
+    """
+    root : str = attr.ib()
+    config : SynthConfig = attr.ib()
+    num_defs : int = attr.ib()
+    num_calls : int = attr.ib()
+    samples : list = attr.ib()
+
+
+class _Layout:
+    """File layout and FFI conventions of a dialect."""
+    def fixed_files(self, num_modules):
+        """Files that do not depend on the density, dict of path to text."""
+        return {}
+
+    def fixed_module_files(self, module):
+        """Files of each module, dict of path to text."""
+        return {}
+
+    def func_name(self, module, index, k):
+        return "m%d_f%d_%d" % (module, index, k)
+
+    def key(self, module, name):
+        return name
+
+    def cc_path(self, module, index):
+        raise NotImplementedError()
+
+    def cc_header(self, module, index):
+        return ["#include <cstdint>\n", "\n"]
+
+    def cc_def(self, module, name, k):
+        """Lines of a registration, the key is on the first line."""
+        raise NotImplementedError()
+
+    def py_path(self, module, index):
+        raise NotImplementedError()
+
+    def py_header(self, module):
+        return []
+
+    def py_footer(self, module):
+        return []
+
+    def py_call(self, module, name):
+        """The call expression of name and the offset of name in it."""
+        raise NotImplementedError()
+
+
+class _TVMLayout(_Layout):
+    package = "tvm"
+    macro = "TVM_REGISTER_GLOBAL"
+
+    def fixed_files(self, num_modules):
+        pkg = "python/%s/" % self.package
+        files = {pkg + "__init__.py": "",
+                 pkg + "_ffi/__init__.py": "",
+                 pkg + "_ffi/function.py":
+                 "def _init_api(namespace, target_module_name=None):\n    pass\n"}
+        for module in range(num_modules):
+            files[pkg + "m%d/__init__.py" % module] = ""
+        return files
+
+    def key(self, module, name):
+        return "m%d.%s" % (module, name)
+
+    def cc_path(self, module, index):
+        return "src/m%d/f%d.cc" % (module, index)
+
+    def cc_def(self, module, name, k):
+        return ["%s(\"%s\")\n" % (self.macro, self.key(module, name)),
+                ".set_body_typed([](int x) {\n",
+                "  return x + %d;\n" % k,
+                "});\n"]
+
+    def py_path(self, module, index):
+        return "python/%s/m%d/use%d.py" % (self.package, module, index)
+
+    def fixed_module_files(self, module):
+        return {"python/%s/m%d/_ffi_api.py" % (self.package, module):
+                "from .._ffi.function import _init_api\n\n"
+                "_init_api(\"%s.m%d\", __name__)\n" % (self.package, module)}
+
+    def py_header(self, module):
+        return ["from . import _ffi_api\n", "\n"]
+
+    def py_call(self, module, name):
+        return "_ffi_api.%s(x)" % name, len("_ffi_api.")
+
+
+class _DGLLayout(_TVMLayout):
+    package = "dgl"
+    macro = "DGL_REGISTER_GLOBAL"
+
+    def func_name(self, module, index, k):
+        return "_CAPI_M%dF%d_%d" % (module, index, k)
+
+    def fixed_module_files(self, module):
+        return {}
+
+    def py_header(self, module):
+        return ["from .._ffi.function import _init_api\n", "\n"]
+
+    def py_footer(self, module):
+        return ["\n", "_init_api(\"dgl.m%d\", __name__)\n" % module]
+
+    def py_call(self, module, name):
+        return "%s(x)" % name, 0
+
+
+class _TorchLayout(_Layout):
+    def cc_path(self, module, index):
+        return "torch/csrc/m%d/init%d.cpp" % (module, index)
+
+    def cc_def(self, module, name, k):
+        return ["m.def(\"%s\", [](int x) {\n" % name,
+                "  return x + %d;\n" % k,
+                "});\n"]
+
+    def py_path(self, module, index):
+        return "torch/m%d/use%d.py" % (module, index)
+
+    def fixed_files(self, num_modules):
+        return {"torch/__init__.py": ""}
+
+    def py_header(self, module):
+        return ["import torch\n", "\n"]
+
+    def py_call(self, module, name):
+        return "torch._C.%s(x)" % name, len("torch._C.")
+
+
+class _MXNetLayout(_Layout):
+    def fixed_files(self, num_modules):
+        return {"python/mxnet/__init__.py": "",
+                "python/mxnet/base.py": "_LIB = None\n\n\ndef check_call(ret):\n    pass\n"}
+
+    def func_name(self, module, index, k):
+        return "MXM%dF%dN%d" % (module, index, k)
+
+    def cc_path(self, module, index):
+        return "src/c_api/m%d/c_api_%d.cc" % (module, index)
+
+    def cc_def(self, module, name, k):
+        return ["int %s(int x) {\n" % name,
+                "  return x + %d;\n" % k,
+                "}\n"]
+
+    def py_path(self, module, index):
+        return "python/mxnet/m%d/use%d.py" % (module, index)
+
+    def py_header(self, module):
+        return ["from ..base import _LIB, check_call\n", "\n"]
+
+    def py_call(self, module, name):
+        return "check_call(_LIB.%s(x))" % name, len("check_call(_LIB.")
+
+
+class _TaichiLayout(_TorchLayout):
+    def fixed_files(self, num_modules):
+        return {"python/taichi/__init__.py": ""}
+
+    def cc_path(self, module, index):
+        return "taichi/python/m%d/export%d.cpp" % (module, index)
+
+    def py_path(self, module, index):
+        return "python/taichi/m%d/use%d.py" % (module, index)
+
+    def py_header(self, module):
+        return ["import taichi as ti\n", "\n"]
+
+    def py_call(self, module, name):
+        return "ti.core.%s(x)" % name, len("ti.core.")
+
+
+_LAYOUTS = {
+    "tvm": _TVMLayout,
+    "torch": _TorchLayout,
+    "dgl": _DGLLayout,
+    "mxnet": _MXNetLayout,
+    "taichi": _TaichiLayout,
+}
+
+
+def _write(root, path, text, made_dirs):
+    path = os.path.join(root, path)
+    dirname = os.path.dirname(path)
+    if dirname not in made_dirs:
+        os.makedirs(dirname, exist_ok=True)
+        made_dirs.add(dirname)
+    with open(path, "w") as fo:
+        fo.write(text)
+
+
+def load_repo(root):
+    """Load the manifest of a generated repository, None if there is none."""
+    path = os.path.join(root, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as fi:
+        data = json.load(fi)
+    return SynthRepo(root=root, config=SynthConfig(**data["config"]),
+                     num_defs=data["num_defs"], num_calls=data["num_calls"],
+                     samples=[CallSite(*x) for x in data["samples"]])
+
+
+def generate_repo(root, config):
+    """Generate a synthetic repository.
+
+    A repository generated from the same config is reused.
+
+    Parameters
+    ----------
+    root : str
+        The root directory, created if it does not exist.
+
+    config : SynthConfig
+        The shape of the repository.
+
+    Returns
+    -------
+    repo : SynthRepo
+        The generated repository.
+    """
+    repo = load_repo(root)
+    if repo is not None and repo.config == config:
+        return repo
+    if repo is not None:
+        raise ValueError("%s holds a repository of another config" % root)
+    layout = _LAYOUTS[config.dialect]()
+    rng = random.Random(config.seed)
+    num_py = int(config.num_files * config.py_ratio)
+    num_cc = max(1, config.num_files - num_py)
+    num_modules = max(1, num_cc // config.files_per_module)
+    made_dirs = set()
+
+    files = layout.fixed_files(num_modules)
+    for module in range(num_modules):
+        files.update(layout.fixed_module_files(module))
+    for path, text in files.items():
+        _write(root, path, text, made_dirs)
+
+    module2names = [[] for _ in range(num_modules)]
+    for index in range(num_cc):
+        module = index % num_modules
+        lines = layout.cc_header(module, index)
+        for k in range(config.defs_per_file):
+            name = layout.func_name(module, index, k)
+            module2names[module].append(name)
+            lines += layout.cc_def(module, name, k)
+            lines += ["static int helper_%d_%d = %d;\n" % (k, j, j)
+                      for j in range(config.filler_lines)]
+        _write(root, layout.cc_path(module, index), "".join(lines), made_dirs)
+
+    samples = []
+    num_calls = 0
+    for index in range(num_py):
+        module = index % num_modules
+        path = layout.py_path(module, index)
+        lines = layout.py_header(module)
+        for k in range(config.calls_per_file):
+            name = rng.choice(module2names[module])
+            call, offset = layout.py_call(module, name)
+            lines += ["\n", "def run_%d(x):\n" % k]
+            lines += ["    y%d = x + %d\n" % (j, j) for j in range(config.filler_lines)]
+            # reservoir sampling of the call sites
+            site = CallSite(layout.key(module, name), path, len(lines),
+                            len("    return ") + offset)
+            if len(samples) < config.num_samples:
+                samples.append(site)
+            else:
+                pos = rng.randrange(num_calls + 1)
+                if pos < config.num_samples:
+                    samples[pos] = site
+            num_calls += 1
+            lines.append("    return %s\n" % call)
+        lines += layout.py_footer(module)
+        _write(root, path, "".join(lines), made_dirs)
+
+    repo = SynthRepo(root=root, config=config, num_defs=num_cc * config.defs_per_file,
+                     num_calls=num_calls, samples=samples)
+    # written last, an interrupted generation is not reused
+    with open(os.path.join(root, MANIFEST), "w") as fo:
+        json.dump({"config": attr.asdict(config), "num_defs": repo.num_defs,
+                   "num_calls": num_calls,
+                   "samples": [attr.astuple(x) for x in samples]}, fo)
+    return repo
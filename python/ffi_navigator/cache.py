@@ -0,0 +1,198 @@
+"""Persistent on-disk cache of per-file extraction results."""
+import hashlib
+import os
+import pickle
+import attr
+
+
+
+@attr.s
+class CacheEntry:
+    """Cached extraction results of a single file.
+
+    Parameters
+    ----------
+    mtime_ns : int
+        The modification time of the file when it was extracted.
+
+    size : int
+        The size of the file when it was extracted.
+
+    digest : Optional[str]
+        Content hash of the file, used when mtime changes but content does not.
+
+    imports : Optional[list of PyImport]
+        The python imports of the file, None for non-python files.
+
+    patterns : Optional[list]
+        The extracted patterns encoded by index.encode_patterns,
+        None if the file needs to be extracted again.
+    """
+    mtime_ns : int = attr.ib()
+    size : int = attr.ib()
+    digest : str = attr.ib(default=None)
+    imports = attr.ib(default=None)
+    patterns = attr.ib(default=None)
+
+
+def _digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+_SOURCE_DIGEST = None
+
+
+def source_digest():
+    """Digest of the python sources of the package.
+
+    The sources define the format of the entries and the extraction rules,
+    so the cache is discarded whenever any of them changes.
+    """
+    global _SOURCE_DIGEST
+    if _SOURCE_DIGEST is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        paths = []
+        for dirpath, _, filenames in os.walk(root):
+            paths += [os.path.join(dirpath, x) for x in filenames if x.endswith(".py")]
+        sha = hashlib.sha1()
+        for path in sorted(paths):
+            sha.update(os.path.relpath(path, root).encode("utf-8"))
+            with open(path, "rb") as fi:
+                sha.update(fi.read())
+        _SOURCE_DIGEST = sha.hexdigest()
+    return _SOURCE_DIGEST
+
+
+class IndexCache:
+    """Cache of extraction results of a workspace, validated by file mtime/size/content.
+
+    Parameters
+    ----------
+    cache_dir : Optional[str]
+        The directory to store the cache, the cache is disabled if None.
+
+    root_path : str
+        The root path of the workspace.
+
+    signature : tuple
+        Signature of the extraction setting(e.g. dialects), entries
+        created under a different signature are discarded.
+
+    logger : Logger object
+    """
+    def __init__(self, cache_dir, root_path, signature, logger):
+        self.cache_dir = cache_dir
+        self.logger = logger
+        self._signature = (source_digest(), os.path.abspath(root_path), signature)
+        self._entries = {}
+        self._visited = set()
+        self._dirty = False
+        if cache_dir is not None:
+            key = _digest(self._signature[1].encode("utf-8"))[:16]
+            self.path = os.path.join(cache_dir, "index-%s.pkl" % key)
+        else:
+            self.path = None
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def load(self):
+        """Load the cache from disk, stale or corrupted cache is ignored."""
+        self._entries = {}
+        self._visited = set()
+        self._dirty = False
+        if not self.enabled or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "rb") as fi:
+                data = pickle.load(fi)
+        except Exception as err:  # pylint: disable=broad-except
+            self.logger.warning("IndexCache: failed to load %s: %s", self.path, err)
+            return
+        if not isinstance(data, dict) or data.get("signature") != self._signature:
+            self.logger.info("IndexCache: signature mismatch, ignore %s", self.path)
+            return
+        self._entries = data["entries"]
+        self.logger.info("IndexCache: loaded %d entries from %s", len(self._entries), self.path)
+
+    def lookup(self, path, stat=None):
+        """Look up the cache entry of a file.
+
+        Parameters
+        ----------
+        path : str
+            The file path.
+
+        stat : Optional[os.stat_result]
+            The stat of the file if it is already known.
+
+        Returns
+        -------
+        entry : CacheEntry
+            The entry of the file, entry.patterns is None if the cached
+            results cannot be used and the file needs to be extracted.
+
+        data : Optional[bytes]
+            The content of the file if it was read during validation.
+        """
+        self._visited.add(path)
+        stat = os.stat(path) if stat is None else stat
+        entry = self._entries.get(path)
+        if (entry is not None and
+                entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size):
+            return entry, None
+
+        with open(path, "rb") as fi:
+            data = fi.read()
+        if not self.enabled:
+            return CacheEntry(stat.st_mtime_ns, stat.st_size), data
+
+        digest = _digest(data)
+        self._dirty = True
+        if entry is not None and entry.digest == digest:
+            # content unchanged, only refresh the stat
+            entry.mtime_ns = stat.st_mtime_ns
+            entry.size = stat.st_size
+            return entry, data
+        entry = CacheEntry(stat.st_mtime_ns, stat.st_size, digest)
+        self._entries[path] = entry
+        return entry, data
+
+    def removed(self, paths):
+        """Get the paths of the loaded entries that are not in paths, e.g. of deleted files."""
+        paths = set(paths)
+        return [path for path in self._entries if path not in paths]
+
+    def store(self, entry, imports, patterns):
+        """Store the extraction results into an entry returned by lookup."""
+        entry.imports = imports
+        entry.patterns = patterns
+        self._dirty = True
+
+    def save(self):
+        """Save the entries visited since the last load to disk.
+
+        The entries are released from memory after saving.
+        """
+        if not self.enabled:
+            return
+        removed = set(self._entries.keys()) - self._visited
+        for path in removed:
+            del self._entries[path]
+        if not self._dirty and not removed:
+            self._entries = {}
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as fo:
+                pickle.dump({"signature": self._signature, "entries": self._entries},
+                            fo, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except OSError as err:
+            self.logger.warning("IndexCache: failed to save %s: %s", self.path, err)
+        else:
+            self.logger.info("IndexCache: saved %d entries to %s", len(self._entries), self.path)
+        self._dirty = False
+        self._entries = {}
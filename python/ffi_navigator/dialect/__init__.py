@@ -1,10 +1,37 @@
 """Namespace for FFI export dialects"""
 import os
-from .tvm import TVMProvider
-from .dgl import DGLProvider
-from .mxnet import MXNetProvider
-from .torch import TorchProvider
-from .taichi import TaichiProvider
+import sys
+import importlib
+
+# The dialects in the order of detection, (path to detect, module, provider class).
+# The provider modules are only imported when the dialect is detected.
+_DIALECTS = [
+    (("python", "tvm"), "tvm", "TVMProvider"),
+    (("python", "mxnet"), "mxnet", "MXNetProvider"),
+    (("torch",), "torch", "TorchProvider"),
+    (("python", "dgl"), "dgl", "DGLProvider"),
+    (("python", "taichi"), "taichi", "TaichiProvider"),
+]
+
+
+def _provider_class(module, name):
+    return getattr(importlib.import_module("." + module, __name__), name)
+
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # the provider classes are imported on first access (PEP 562)
+        for _, module, class_name in _DIALECTS:
+            if name == class_name:
+                return _provider_class(module, class_name)
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+else:
+    # module __getattr__ needs python 3.7, import the provider classes eagerly
+    from .tvm import TVMProvider
+    from .mxnet import MXNetProvider
+    from .torch import TorchProvider
+    from .dgl import DGLProvider
+    from .taichi import TaichiProvider
 
 
 def autodetect_dialects(root_path, resolver, logger):
@@ -26,14 +53,8 @@ def autodetect_dialects(root_path, resolver, logger):
     dialects: list of provider
     """
     dialects = []
-    if os.path.exists(os.path.join(root_path, "python", "tvm")):
-        dialects.append(TVMProvider(resolver, logger))
-    elif os.path.exists(os.path.join(root_path, "python", "mxnet")):
-        dialects.append(MXNetProvider(resolver, logger))
-    elif os.path.exists(os.path.join(root_path, "torch")):
-        dialects.append(TorchProvider(resolver, logger))
-    elif os.path.exists(os.path.join(root_path, "python", "dgl")):
-        dialects.append(DGLProvider(resolver, logger))
-    elif os.path.exists(os.path.join(root_path, "python", "taichi")):
-        dialects.append(TaichiProvider(resolver, logger))
+    for detect_path, module, class_name in _DIALECTS:
+        if os.path.exists(os.path.join(root_path, *detect_path)):
+            dialects.append(_provider_class(module, class_name)(resolver, logger))
+            break
     return dialects
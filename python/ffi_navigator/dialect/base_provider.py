@@ -31,12 +31,37 @@ class BaseProvider(object):
         return []
 
     def init_pass(self, path, source):
-        """This function will be called for each file before extract."""
+        """This function will be called for each file before extract.
+
+        source can be None when the extraction results of the file
+        are loaded from the index cache.
+        """
         if path.endswith(normalize_path("%s/__init__.py" % self.dialect_name)):
             self._pypath_root = os.path.abspath(path[:-len("/__init__.py")])
             self.resolver.add_package(self.dialect_name, self._pypath_root)
             self.logger.info("%s: found python path %s", self.dialect_name, self._pypath_root)
 
+    def matchers(self):
+        """Get the matchers of the provider.
+
+        Returns
+        -------
+        matchers : dict of str to Matcher
+            Map from the attribute name of the matcher to the matcher.
+        """
+        return {name: value for name, value in vars(self).items()
+                if isinstance(value, pattern.Matcher)}
+
+    def matcher_stats(self):
+        """Get the counters of the matchers of the provider.
+
+        Returns
+        -------
+        stats : dict of str to MatcherStats
+            Map from the attribute name of the matcher to its counters.
+        """
+        return {name: value.stats for name, value in self.matchers().items()}
+
     def _cc_extract(self, path, source, begin, end):
         """Override this method in the derived class."""
         return []
@@ -48,7 +73,12 @@ class BaseProvider(object):
     def extract(self, path, source, begin=0, end=None):
         """This function will be called for each file
         Extract patterns in the file as specified in pattern.py and return them.
+
+        The source is passed to the derived class as a pattern.SourceBuffer,
+        the patterns can be returned as any iterable, e.g. the list
+        returned by a scanner created by pattern.fused_matcher.
         """
+        source = pattern.SourceBuffer.wrap(source)
         cpp_ext = [".cpp", ".cc", ".h"]
         for ext in cpp_ext:
             if path.endswith(ext):
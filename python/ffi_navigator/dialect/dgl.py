@@ -25,7 +25,7 @@ class DGLProvider(BaseProvider):
             r"\s*static\s+constexpr\sconst\s+char\s*\*\s+_type_key\s*=\s*\"(?P<key>[^\"]+)\"",
             lambda match, path, rg:
             pattern.Def(key="t:"+match.group("key"), path=path, range=rg),
-            use_search=True)
+            use_search=True, literals=["_type_key"])
         self.cc_get_packed = pattern.func_get_searcher(
             ["GetPackedFunc", "runtime::Registry::Get"],
             lambda key, path, rg, _:
@@ -40,6 +40,11 @@ class DGLProvider(BaseProvider):
             ["register_func"], "def",
             lambda key, path, rg, reg: self._wrap_py_reg_func(key, path, rg, reg))
 
+        self._cc_scanner = pattern.fused_matcher(
+            [self.cc_def_packed, self.cc_def_object, self.cc_get_packed])
+        self._py_scanner = pattern.fused_matcher(
+            [self.py_init_api, self.py_reg_object, self.py_reg_func])
+
         self._pypath_api_internal = None
         self._pypath_funcmod = None
         self._pypath_init = None
@@ -56,32 +61,15 @@ class DGLProvider(BaseProvider):
         if new_mod != self._pypath_funcmod or new_name != "_init_api":
             return None
         prefix = key[4:] if key.startswith("dgl.") else key
-        fkey2var = lambda k : k[len(prefix) + 1:]
-        fvar2key = lambda v : prefix + "." + v
-
-        return pattern.Export(key_prefix=prefix, path=path,
-                              fvar2key=fvar2key,
-                              fkey2var=fkey2var)
+        return pattern.prefix_export(prefix, path, prefix + ".")
 
     def _cc_extract(self, path, source, begin, end):
-        results = []
-        results += self.cc_def_packed(path, source, begin, end)
-        results += self.cc_def_object(path, source)
-        results += self.cc_get_packed(path, source)
-        return results
+        return self._cc_scanner(path, source, begin, end)
 
     def _py_extract(self, path, source, begin, end):
-        results = []
-        results += self.py_init_api(path, source, begin, end)
-        results += self.py_reg_object(path, source, begin, end)
-        results += self.py_reg_func(path, source, begin, end)
+        yield from self._py_scanner(path, source, begin, end)
         if path.startswith(self._pypath_api_internal):
-            export_item = pattern.Export(
-                key_prefix="_", path=path,
-                fvar2key=lambda x: x,
-                fkey2var=lambda x: x)
-            results.append(export_item)
-        return results
+            yield pattern.prefix_export("_", path, "")
 
     def init_pass(self, path, source):
         if path.endswith(normalize_path("python/dgl/__init__.py")):
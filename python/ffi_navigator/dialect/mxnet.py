@@ -23,7 +23,8 @@ class MXNetProvider(BaseProvider):
         self.py_lib = pattern.re_matcher(
             r".*_LIB\.(?P<key>MX[A-Za-z0-9]+)",
             lambda match, path, rg:
-            pattern.Ref(key=match.group("key"), path=path, range=rg))
+            pattern.Ref(key=match.group("key"), path=path, range=rg),
+            literals=["_LIB."])
 
     def _cc_extract(self, path, source, begin, end):
         if "c_api" in path:
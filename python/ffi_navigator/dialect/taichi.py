@@ -24,15 +24,14 @@ class TaichiProvider(BaseProvider):
         self.py_ti_core = pattern.re_matcher(r"[\.|_]?core\.(?P<key>[A-Za-z0-9_]+)",
                                              lambda match, path, rg:
                                              pattern.Ref(key=match.group("key"), path=path, range=rg),
-                                             use_search=True)
+                                             use_search=True, literals=["core."])
+        self._cc_scanner = pattern.fused_matcher([self.cpp_pybind_func, self.cpp_pybind_class])
 
     def get_additional_scan_dirs(self, root_path):
         return [os.path.join(root_path, "taichi")]
 
     def _cc_extract(self, path, source, begin, end):
-        results = self.cpp_pybind_func(path, source)
-        results += self.cpp_pybind_class(path, source)
-        return results
+        return self._cc_scanner(path, source, begin, end)
 
     def _py_extract(self, path, source, begin, end):
         return self.py_ti_core(path, source, begin, end)
@@ -27,7 +27,7 @@ class TorchProvider(BaseProvider):
             r"\.op\(\s*\"(?P<key>[a-z0-9|_|::]+)(.*)\"",
             lambda match, path, rg:
             pattern.Def(key=match.group("key"), path=path, range=rg),
-            use_search=True)
+            use_search=True, literals=[".op("])
         # C extensions wrapped via PyMethodDef (not pybind)
         # static struct PyMethodDef THPFunction_methods[] = {
         #   {(char*)"_do_forward", (PyCFunction)THPFunction_do_forward, METH_VARARGS, nullptr},
@@ -41,7 +41,7 @@ class TorchProvider(BaseProvider):
             r"{(\(char\*\))?\"(?P<key>[a-z0-9|_]+)\"",
             lambda match, path, rg:
             pattern.Def(key=match.group("key"), path=path, range=rg),
-            use_search=True)
+            use_search=True, literals=["{\"", "{(char*)\""])
         # A pattern for pybind-wrapped functions
         # .def(
         #     "_jit_pass_insert_prepack_unpack",
@@ -60,7 +60,7 @@ class TorchProvider(BaseProvider):
             lambda match, path, rg:
             pattern.Ref(key=match.group("key_namespace") + "::" + match.group("key_op"),
                         path=path, range=rg),
-            use_search=True)
+            use_search=True, literals=["ops."])
         # torch.conv1d, torch._C._nn.avg_pool2d (variable methods)
         # torch._C._jit_script_class_compile (for jit etc)
         # torch._C.ScriptMethod, torch._C.CompilationUnit
@@ -78,7 +78,14 @@ class TorchProvider(BaseProvider):
             lambda match, path, rg:
             pattern.Ref(key=match.group("key"),
                         path=path, range=rg),
-            use_search=True)
+            use_search=True, literals=["._c."])
+
+        cc_matchers = [self.c10_reg, self.cpp_pybind_func, self.cpp_pybind_class]
+        self._cc_scanner = pattern.fused_matcher(cc_matchers)
+        self._cc_method_def_scanner = pattern.fused_matcher(
+            cc_matchers + [self.cpp_py_method_def])
+        self._py_scanner = pattern.fused_matcher(
+            [self.py_ops, self.py_wrapped, self.py_wrapped_method])
 
     def get_additional_scan_dirs(self, root_path):
         return [
@@ -95,20 +102,12 @@ class TorchProvider(BaseProvider):
         if any(path.endswith(generated) for generated in generated_cpp):
             return self.cpp_py_method_def(path, source, begin, end)
 
-        results = self.c10_reg(path, source, begin, end)
-        results += self.cpp_pybind_func(path, source)
-        results += self.cpp_pybind_class(path, source)
-
-        if "PyMethodDef" in "".join(source):
-            results += self.cpp_py_method_def(path, source, begin, end)
-
-        return results
+        if "PyMethodDef" in source.text:
+            return self._cc_method_def_scanner(path, source, begin, end)
+        return self._cc_scanner(path, source, begin, end)
 
     def _py_extract(self, path, source, begin, end):
-        results = self.py_ops(path, source, begin, end)
-        results += self.py_wrapped(path, source, begin, end)
-        results += self.py_wrapped_method(path, source, begin, end)
-        return results
+        return self._py_scanner(path, source, begin, end)
 
     def extract(self, path, source, begin=0, end=None):
         if not path.endswith("_test.cpp"):
@@ -0,0 +1,159 @@
+"""In-memory store of the documents used by the language server."""
+import os
+import threading
+from collections import OrderedDict
+from . import pattern
+from .util import decode_text, normalize_text
+
+
+class Document:
+    """A version of a document.
+
+    Parameters
+    ----------
+    path : str
+        The file path.
+
+    version : Optional[int]
+        The version given by the client, None for documents read from disk.
+
+    source : pattern.SourceBuffer
+        The content of the document.
+    """
+    __slots__ = ["path", "version", "source"]
+
+    def __init__(self, path, version, source):
+        self.path = path
+        self.version = version
+        self.source = source
+
+
+def apply_change(source, change):
+    """Apply a textDocument/didChange content change to source.
+
+    Parameters
+    ----------
+    source : pattern.SourceBuffer
+        The current content.
+
+    change : dict
+        The TextDocumentContentChangeEvent, the whole content if it has no range.
+
+    Returns
+    -------
+    source : pattern.SourceBuffer
+        The new content.
+    """
+    text = normalize_text(change["text"])
+    rg = change.get("range")
+    if rg is None:
+        return pattern.SourceBuffer(text)
+    line_starts = source.line_starts
+
+    def _offset(pos):
+        line = pos["line"]
+        if line >= len(source):
+            return len(source.text)
+        return line_starts[line] + min(pos["character"], len(source[line].rstrip("\n")))
+
+    old_text = source.text
+    return pattern.SourceBuffer(
+        old_text[:_offset(rg["start"])] + text + old_text[_offset(rg["end"]):])
+
+
+class DocumentStore:
+    """Versioned contents of the documents opened in the editor.
+
+    Documents that are not opened are read from disk, the last few
+    of them are kept as long as the file is not modified.
+
+    Parameters
+    ----------
+    max_disk_docs : int
+        Number of documents read from disk to keep.
+    """
+    def __init__(self, max_disk_docs=8):
+        self.max_disk_docs = max_disk_docs
+        self._opened = {}
+        self._disk_docs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, path, text, version=None):
+        """Set the content of a document opened by the editor."""
+        doc = Document(path, version, pattern.SourceBuffer(normalize_text(text)))
+        with self._lock:
+            self._opened[path] = doc
+        return doc
+
+    def change(self, path, changes, version=None):
+        """Apply the content changes to a document.
+
+        Parameters
+        ----------
+        path : str
+            The file path.
+
+        changes : list of dict
+            The content changes, applied in order.
+
+        version : Optional[int]
+            The version after the changes, changes older than
+            the stored version are ignored.
+
+        Returns
+        -------
+        doc : Document
+            The updated document.
+        """
+        with self._lock:
+            doc = self._opened.get(path)
+            if doc is not None and None not in (doc.version, version) and version <= doc.version:
+                return doc
+            source = doc.source if doc is not None else None
+            for change in changes:
+                if source is None and "range" in change:
+                    source = self._read(path).source
+                source = apply_change(source, change)
+            if source is None:
+                return doc
+            doc = Document(path, version, source)
+            self._opened[path] = doc
+            return doc
+
+    def close(self, path):
+        """Forget the content of a document closed by the editor."""
+        with self._lock:
+            self._opened.pop(path, None)
+
+    def get(self, path):
+        """Get the current document of path.
+
+        Parameters
+        ----------
+        path : str
+            The file path.
+
+        Returns
+        -------
+        doc : Document
+            The opened document, or the document read from disk.
+        """
+        with self._lock:
+            doc = self._opened.get(path)
+            if doc is not None:
+                return doc
+            return self._read(path)
+
+    def _read(self, path):
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        item = self._disk_docs.get(path)
+        if item is not None and item[0] == stamp:
+            self._disk_docs.move_to_end(path)
+            return item[1]
+        with open(path, "rb") as fi:
+            doc = Document(path, None, pattern.SourceBuffer(decode_text(fi.read())))
+        self._disk_docs[path] = (stamp, doc)
+        if len(self._disk_docs) > self.max_disk_docs:
+            self._disk_docs.popitem(last=False)
+        return doc
@@ -1,8 +1,10 @@
 """A resolver to resolve expression to the original definition point."""
 import os
 import logging
+import threading
 from .pattern import find_py_imports
-from .util import normalize_path
+from .index import PersistentMap
+from .util import normalize_path, approx_size
 from typing import Dict, List, Tuple
 
 def _num_leading_dots(path):
@@ -13,12 +15,65 @@ def _num_leading_dots(path):
 
 
 class PyImportResolver:
-    """Resolve the original module path and sym_name."""
+    """Resolve the original module path and sym_name.
+
+    resolve can be called from multiple threads, also while the
+    imports are being updated by another thread. The states are kept
+    in PersistentMap, so that a copy is O(1).
+    """
     def __init__(self):
-        self._modpath2imports = {}
-        self._modpath2init = {}
+        self._modpath2imports = PersistentMap()
+        self._modpath2init = PersistentMap()
         self._pkg2modpath = {}
-        self._recurr_depth = 0
+        # reverse import graph: (target_mod, name) -> set of (mod_path, alias)
+        self._target2importers = PersistentMap()
+        # memo of resolve: (mod_path, attr_name) -> result
+        self._memo = PersistentMap()
+        # module path -> memo keys whose resolution probed the module
+        self._dep2keys = PersistentMap()
+        # guards the updates, bumps the generation when the memo is invalidated
+        self._lock = threading.RLock()
+        self._generation = 0
+
+    def copy(self):
+        """Create a copy that is not affected by later document updates."""
+        resolver = PyImportResolver()
+        with self._lock:
+            resolver._modpath2imports = self._modpath2imports.copy()
+            resolver._modpath2init = self._modpath2init.copy()
+            resolver._pkg2modpath = dict(self._pkg2modpath)
+            resolver._target2importers = self._target2importers.copy()
+            resolver._memo = self._memo.copy()
+            resolver._dep2keys = self._dep2keys.copy()
+        return resolver
+
+    def version(self):
+        """An object that changes whenever the imports change.
+
+        Compared by identity, see PersistentMap.version.
+        """
+        return (self._modpath2imports.version(), self._modpath2init.version(),
+                tuple(self._pkg2modpath.items()))
+
+    def __getstate__(self):
+        # the resolver is sent to the extraction workers with the providers
+        state = dict(self.__dict__)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def num_modules(self):
+        """Number of python modules whose imports are known."""
+        return len(self._modpath2imports)
+
+    def memory_size(self):
+        """Approximate memory used by the resolver in bytes."""
+        with self._lock:
+            return approx_size((self._modpath2imports, self._modpath2init, self._pkg2modpath,
+                                self._target2importers, self._memo, self._dep2keys))
 
     def add_package(self, package, mod_path):
         """Add root path of a package to the resolver.
@@ -33,7 +88,11 @@ class PyImportResolver:
         mod_path : str
             The path to the package
         """
-        self._pkg2modpath[package] = mod_path
+        with self._lock:
+            self._pkg2modpath[package] = mod_path
+            self._memo = PersistentMap()
+            self._dep2keys = PersistentMap()
+            self._generation += 1
 
     def resolve(self, mod_path, attr_name):
         """Try to resolve an attribute expression to its original definition point.
@@ -54,6 +113,22 @@ class PyImportResolver:
         sym_name: Optional[str]
             The resolved name, can be None if it is a module.
         """
+        key = (mod_path, attr_name)
+        result = self._memo.get(key)
+        if result is None:
+            generation = self._generation
+            deps = set()
+            result = self._resolve(mod_path, attr_name, deps)
+            with self._lock:
+                # the result can be stale if the imports were updated meanwhile
+                if generation == self._generation:
+                    self._memo[key] = result
+                    for dep in deps:
+                        self._dep2keys.mutable(dep, set).add(key)
+        return result
+
+    def _resolve(self, mod_path, attr_name, deps):
+        """Resolve without memo, record the probed module paths in deps."""
         # lookup packages
         if not mod_path.startswith(normalize_path("/")):
             arr = mod_path.split(normalize_path("/"), 1)
@@ -64,32 +139,33 @@ class PyImportResolver:
         if mod_path.endswith(".py"):
             mod_path = mod_path[:-3]
 
-        self._recurr_depth = 0
         arr = attr_name.split(".", 1)
         if len(arr) == 1:
-            return self._resolve_var(mod_path, arr[0], allow_combine_path=False)
+            return self._resolve_var(mod_path, arr[0], deps, allow_combine_path=False)
         new_mod, new_var = self._resolve_var(
-            mod_path, arr[0], allow_combine_path=False)
+            mod_path, arr[0], deps, allow_combine_path=False)
         if new_var is None:
-            return self.resolve(new_mod, arr[1])
+            return self._resolve(new_mod, arr[1], deps)
         # Failed to resolve further
         return (mod_path, attr_name)
 
-    def _resolve_var(self, mod_path, var_name, allow_combine_path=True):
+    def _resolve_var(self, mod_path, var_name, deps, allow_combine_path=True, depth=1):
         """Resolve from mod_path import var_name"""
         # Avoid deep recursion
-        self._recurr_depth += 1
-        if self._recurr_depth > 10:
+        if depth > 10:
             return (mod_path, var_name)
         # First check whether we can resolve to a module
         if allow_combine_path:
             combined_path = os.path.join(mod_path, var_name)
+            deps.add(combined_path)
             if (combined_path in self._modpath2imports or
                 combined_path in self._modpath2init):
                 return (combined_path, None)
         # mod/ -> mod/__init__
+        deps.add(mod_path)
         if mod_path in self._modpath2init:
             mod_path = self._modpath2init[mod_path]
+            deps.add(mod_path)
         if mod_path not in self._modpath2imports:
             return (mod_path, var_name)
         # Check the imports
@@ -98,7 +174,7 @@ class PyImportResolver:
             new_mod, new_var = imports[var_name]
             if new_var is None:
                 return (new_mod, new_var)
-            return self._resolve_var(new_mod, new_var)
+            return self._resolve_var(new_mod, new_var, deps, depth=depth + 1)
         return (mod_path, var_name)
 
     def _resolve_mod_path(self, curr_dir, from_mod):
@@ -124,17 +200,130 @@ class PyImportResolver:
         source : list or str
             The source code.
         """
+        self.update_imports(path, find_py_imports(source))
+
+    def update_imports(self, path, py_imports):
+        """Update the resolver state by adding the imports of a document.
+
+        Parameters
+        ----------
+        path : str
+            The module path
+
+        py_imports : list of PyImport
+            The imports discovered in the document.
+        """
         path = os.path.abspath(path)
         if path.endswith(".py"):
             path = path[:-3]
         imports = {}
-        for item in find_py_imports(source):
+        for item in py_imports:
             target_mod = self._resolve_mod_path(
                 os.path.dirname(path), item.from_mod)
             if target_mod is not None:
                 alias = item.alias if item.alias else item.import_name
                 imports[alias] = (target_mod, item.import_name)
-        self._modpath2imports[path] = imports
+        with self._lock:
+            self._remove_importer(path)
+            self._modpath2imports[path] = imports
+            self._invalidate(path)
+            for alias, target in imports.items():
+                self._target2importers.mutable(target, set).add((path, alias))
+            init = normalize_path("/__init__")
+            if path.endswith(init):
+                self._modpath2init[path[:-len(init)]] = path
+
+    def remove_doc(self, path):
+        """Remove a document from the resolver.
+
+        Parameters
+        ----------
+        path : str
+            The module path
+        """
+        path = os.path.abspath(path)
+        if path.endswith(".py"):
+            path = path[:-3]
+        with self._lock:
+            self._remove_importer(path)
+            self._modpath2imports.pop(path, None)
+            self._invalidate(path)
+            init = normalize_path("/__init__")
+            if path.endswith(init) and self._modpath2init.get(path[:-len(init)]) == path:
+                self._modpath2init.pop(path[:-len(init)])
+
+    def _invalidate(self, path):
+        """Drop the memo of resolutions that depend on module path."""
+        self._generation += 1
+        paths = [path]
         init = normalize_path("/__init__")
         if path.endswith(init):
-            self._modpath2init[path[:-len(init)]] = path
+            paths.append(path[:-len(init)])
+        for item in paths:
+            for key in self._dep2keys.pop(item, ()):
+                self._memo.pop(key, None)
+
+    def _remove_importer(self, path):
+        """Remove the reverse import edges of module path."""
+        for alias, target in self._modpath2imports.get(path, {}).items():
+            if (path, alias) in self._target2importers.get(target, ()):
+                importers = self._target2importers.mutable(target, set)
+                importers.discard((path, alias))
+                if not importers:
+                    self._target2importers.pop(target)
+
+    def find_importers(self, mod_path, var_name=None):
+        """Find the imported names that resolve to a variable or a module.
+
+        The reverse import graph is walked from the target, so only
+        the modules that (transitively) import it are visited.
+        It should be called on a copy that is no longer updated.
+
+        Parameters
+        ----------
+        mod_path : str
+            The module path of the target.
+
+        var_name : Optional[str]
+            The variable name, None if the target is the module itself.
+
+        Returns
+        -------
+        importers : dict of str to list of str
+            Map from the importing module path to the local names
+            that resolve to the target.
+        """
+        if var_name is None:
+            keys = [(os.path.dirname(mod_path), os.path.basename(mod_path))]
+        else:
+            keys = self._var_keys(mod_path, var_name)
+        visited = set(keys)
+        candidates = set()
+        stack = list(keys)
+        while stack:
+            for importer in self._target2importers.get(stack.pop(), ()):
+                if importer in candidates:
+                    continue
+                candidates.add(importer)
+                for key in self._var_keys(*importer):
+                    if key not in visited:
+                        visited.add(key)
+                        stack.append(key)
+
+        target = (mod_path, var_name)
+        importers = {}
+        for importer, alias in candidates:
+            if self.resolve(importer, alias) == target:
+                importers.setdefault(importer, set()).add(alias)
+        # keep the order of the import statements
+        return {importer: [x for x in self._modpath2imports[importer] if x in aliases]
+                for importer, aliases in sorted(importers.items())}
+
+    @staticmethod
+    def _var_keys(mod_path, var_name):
+        """Import targets that refer to var_name defined in mod_path."""
+        keys = [(mod_path, var_name)]
+        init = normalize_path("/__init__")
+        if mod_path.endswith(init):
+            keys.append((mod_path[:-len(init)], var_name))
+        return keys
@@ -0,0 +1,646 @@
+"""Index data structures of the workspace."""
+import sys
+from array import array
+from collections.abc import Mapping
+from . import pattern
+from .lsp import Range, Position
+from .util import approx_size
+
+# Kinds of the compact pattern rows.
+KIND_DEF = 0
+KIND_REF = 1
+# Number of ints to store the range of a pattern.
+_RANGE_SIZE = 4
+# Hash bits consumed by each level of PersistentMap.
+_HASH_BITS = 6
+_HASH_MASK = (1 << _HASH_BITS) - 1
+# Hash bits after which the buckets are no longer split.
+_HASH_MAX_SHIFT = 60
+# Number of entries of a bucket before it is split.
+_BUCKET_SIZE = 32
+
+
+def encode_patterns(patterns):
+    """Convert extracted patterns into compact rows.
+
+    Def and Ref become (kind, key, start_line, start_char, end_line, end_char)
+    tuples, which are cheaper to pickle and store, other patterns are kept as is.
+    """
+    results = []
+    for pt in patterns:
+        if isinstance(pt, (pattern.Def, pattern.Ref)):
+            rg = pt.range
+            results.append((KIND_DEF if isinstance(pt, pattern.Def) else KIND_REF, pt.key,
+                            rg.start.line, rg.start.character,
+                            rg.end.line, rg.end.character))
+        else:
+            results.append(pt)
+    return results
+
+
+class StringTable:
+    """Intern strings and map them to integer ids."""
+    def __init__(self):
+        self._str2id = {}
+        self._strs = []
+
+    def intern(self, value):
+        """Get the id of value, add it to the table if not exist."""
+        idx = self._str2id.get(value)
+        if idx is None:
+            idx = len(self._strs)
+            value = sys.intern(value)
+            self._strs.append(value)
+            self._str2id[value] = idx
+        return idx
+
+    def lookup(self, value):
+        """Get the id of value, None if it is not in the table."""
+        return self._str2id.get(value)
+
+    def __getitem__(self, idx):
+        return self._strs[idx]
+
+    def memory_size(self):
+        """Approximate memory used by the table in bytes."""
+        return approx_size((self._str2id, self._strs))
+
+    def __len__(self):
+        return len(self._strs)
+
+
+class _HashNode:
+    """Node of PersistentMap, either an internal node with a list of
+    children or a bucket with a dict of entries."""
+    __slots__ = ["children", "entries", "owner"]
+
+    def __init__(self, children, entries, owner):
+        self.children = children
+        self.entries = entries
+        self.owner = owner
+
+    def copy(self, owner):
+        if self.entries is None:
+            return _HashNode(list(self.children), None, owner)
+        return _HashNode(None, dict(self.entries), owner)
+
+
+def _split_bucket(bucket, shift, owner):
+    children = [None] * (1 << _HASH_BITS)
+    for key, value in bucket.entries.items():
+        index = (hash(key) >> shift) & _HASH_MASK
+        child = children[index]
+        if child is None:
+            children[index] = _HashNode(None, {key: value}, owner)
+        else:
+            child.entries[key] = value
+    return _HashNode(children, None, owner)
+
+
+class PersistentMap(Mapping):
+    """Hash map that is copied in O(1).
+
+    The entries are kept in a hash trie. A copy shares all the nodes,
+    and a change after the copy only copies the nodes on the path to the
+    changed entry, so copying and then changing one entry is O(log n).
+    The nodes created since the last copy are owned by the map and
+    changed in place, so that a batch of changes is almost as fast as
+    with a dict.
+
+    Readers of a map can run in other threads while it is changed,
+    a node is only replaced after the new node is complete.
+    """
+    __slots__ = ["_root", "_size", "_owner", "_owned_values"]
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+        self._owner = object()
+        # the values returned by mutable since the last copy, by key
+        self._owned_values = {}
+
+    def copy(self):
+        """Create a copy in O(1), later changes of either map do not affect the other."""
+        # the shared nodes and values are no longer owned by either map
+        self._owner = object()
+        self._owned_values = {}
+        result = PersistentMap()
+        result._root = self._root
+        result._size = self._size
+        return result
+
+    def __reduce__(self):
+        # the nodes are placed by hash, which differs between processes,
+        # e.g. in the extraction workers, so the map is rebuilt from its items
+        return (_persistent_map, (list(self.items()),))
+
+    def version(self):
+        """An object that is replaced whenever a copy of the map is changed.
+
+        It is compared by identity, and only tells the versions apart
+        among maps that are no longer changed, e.g. the copies held by
+        snapshots.
+        """
+        return self._root
+
+    def mutable(self, key, factory):
+        """Get the value of key for changing it in place, e.g. a dict or a set.
+
+        The value is created with factory() if there is none, and a value
+        shared with a copy is replaced by factory(value) the first time,
+        so only the values changed after a copy are copied.
+        """
+        value = self._owned_values.get(key)
+        if value is None:
+            value = self.get(key)
+            value = factory(value) if value is not None else factory()
+            self[key] = value
+            self._owned_values[key] = value
+        return value
+
+    def get(self, key, default=None):
+        node = self._root
+        if node is None:
+            return default
+        code = hash(key)
+        while node.entries is None:
+            node = node.children[code & _HASH_MASK]
+            if node is None:
+                return default
+            code >>= _HASH_BITS
+        return node.entries.get(key, default)
+
+    def __setitem__(self, key, value):
+        if self._owned_values:
+            self._owned_values.pop(key, None)
+        owner = self._owner
+        node = self._root
+        if node is None:
+            self._root = _HashNode(None, {key: value}, owner)
+            self._size = 1
+            return
+        if node.owner is not owner:
+            node = node.copy(owner)
+            self._root = node
+        code = hash(key)
+        parent, index, shift = None, 0, 0
+        while node.entries is None:
+            parent, index = node.children, (code >> shift) & _HASH_MASK
+            child = parent[index]
+            if child is None:
+                parent[index] = _HashNode(None, {key: value}, owner)
+                self._size += 1
+                return
+            if child.owner is not owner:
+                child = child.copy(owner)
+                parent[index] = child
+            node = child
+            shift += _HASH_BITS
+        entries = node.entries
+        size = len(entries)
+        entries[key] = value
+        if len(entries) == size:
+            return
+        self._size += 1
+        if size >= _BUCKET_SIZE and shift < _HASH_MAX_SHIFT:
+            node = _split_bucket(node, shift, owner)
+            if parent is None:
+                self._root = node
+            else:
+                parent[index] = node
+
+    def pop(self, key, default=None):
+        """Remove key and return its value, default if key is not in the map."""
+        if key not in self:
+            return default
+        self._owned_values.pop(key, None)
+        owner = self._owner
+        code = hash(key)
+        node = self._root
+        if node.owner is not owner:
+            node = node.copy(owner)
+            self._root = node
+        path = []
+        while node.entries is None:
+            index = code & _HASH_MASK
+            path.append((node, index))
+            child = node.children[index]
+            if child.owner is not owner:
+                child = child.copy(owner)
+                node.children[index] = child
+            node = child
+            code >>= _HASH_BITS
+        value = node.entries.pop(key)
+        self._size -= 1
+        # drop the empty nodes
+        while not (node.entries if node.entries is not None else any(node.children)):
+            if not path:
+                self._root = None
+                break
+            node, index = path.pop()
+            node.children[index] = None
+        return value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.pop(key)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def items(self):
+        """Iterate over the (key, value) pairs."""
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            if node.entries is not None:
+                yield from list(node.entries.items())
+            else:
+                stack.extend(x for x in node.children if x is not None)
+
+    def values(self):
+        """Iterate over the values."""
+        for _, value in self.items():
+            yield value
+
+    def __iter__(self):
+        for key, _ in self.items():
+            yield key
+
+    def __len__(self):
+        return self._size
+
+
+_MISSING = object()
+
+
+def _persistent_map(items):
+    """Create a PersistentMap from a list of (key, value), used by pickle."""
+    result = PersistentMap()
+    for key, value in items:
+        result[key] = value
+    return result
+
+
+class PatternTable(Mapping):
+    """Map from key to the list of patterns with the key.
+
+    The ranges are stored as ints in arrays grouped by key and file id,
+    so that all the entries of one file can be removed in O(entries-in-file).
+    Keys are interned and paths are stored as ids of a shared StringTable.
+    The pattern objects are only created when the patterns of a key are queried.
+    The keys are kept in a PersistentMap, so copying the table is O(1), and
+    the groups of a key are copied the first time the key changes after a copy.
+
+    Parameters
+    ----------
+    pattern_type : type
+        The pattern class to create, Def or Ref.
+
+    paths : StringTable
+        The table of file paths.
+    """
+    def __init__(self, pattern_type, paths):
+        self.pattern_type = pattern_type
+        self.paths = paths
+        # key -> dict of path id -> range array
+        self._key2groups = PersistentMap()
+
+    def add(self, key, path_id, start_line, start_char, end_line, end_char):
+        """Add a pattern of key located in the file of path_id."""
+        groups = self._key2groups.mutable(sys.intern(key), dict)
+        rows = groups.get(path_id)
+        if rows is None:
+            rows = array("I")
+            groups[path_id] = rows
+        rows.extend((start_line, start_char, end_line, end_char))
+
+    def copy(self):
+        """Create a copy that is not affected by later add and remove, in O(1).
+
+        The per-file arrays are shared, they are not modified once
+        all the patterns of a file are added.
+        """
+        table = PatternTable(self.pattern_type, self.paths)
+        table._key2groups = self._key2groups.copy()
+        return table
+
+    def remove(self, key, path_id):
+        """Remove all the patterns of key located in the file of path_id."""
+        groups = self._key2groups.get(key)
+        if groups is None or path_id not in groups:
+            return
+        groups = self._key2groups.mutable(key, dict)
+        del groups[path_id]
+        if not groups:
+            self._key2groups.pop(key)
+
+    def version(self, key):
+        """An object that compares equal as long as the patterns of key are the same.
+
+        The groups of a copy are not changed, so comparing them is
+        O(1) unless the key changed after the copy.
+        """
+        return self._key2groups.get(key)
+
+    def rows(self, key, path_id):
+        """Get the range array of key in the file of path_id."""
+        groups = self._key2groups.get(key)
+        return groups.get(path_id, ()) if groups is not None else ()
+
+    def num_items(self):
+        """Total number of patterns in the table."""
+        return sum(len(rows) for groups in self._key2groups.values()
+                   for rows in groups.values()) // _RANGE_SIZE
+
+    def memory_size(self):
+        """Approximate memory used by the table in bytes, not counting the paths."""
+        return approx_size(self._key2groups)
+
+    def iter_groups(self, key):
+        """Iterate over the patterns of key, one list per file in the order of the file ids."""
+        for path_id, rows in sorted(self._key2groups.get(key, {}).items()):
+            path = self.paths[path_id]
+            yield [self.pattern_type(key=key, path=path,
+                                     range=Range(Position(rows[i], rows[i + 1]),
+                                                 Position(rows[i + 2], rows[i + 3])))
+                   for i in range(0, len(rows), _RANGE_SIZE)]
+
+    def __getitem__(self, key):
+        if key not in self._key2groups:
+            raise KeyError(key)
+        return [item for group in self.iter_groups(key) for item in group]
+
+    def __contains__(self, key):
+        return key in self._key2groups
+
+    def __iter__(self):
+        return iter(self._key2groups)
+
+    def __len__(self):
+        return len(self._key2groups)
+
+
+class NameTable:
+    """Index of the python dotted names in each file.
+
+    The names of a file are found in its source on the first search of
+    the file, and grouped by their components. Each component maps to the
+    dotted names of the file that contain it, so searching the names of
+    one file is O(occurrences in the file).
+
+    Parameters
+    ----------
+    paths : StringTable
+        The table of file paths.
+    """
+    def __init__(self, paths):
+        self.paths = paths
+        # path id -> _LazyNames
+        self._files = PersistentMap()
+
+    def add_file(self, path_id, fsource, all_names=False):
+        """Set the source of the file of path_id, replacing its previous names.
+
+        Parameters
+        ----------
+        path_id : int
+            The id of the file path.
+
+        fsource : function() -> SourceBuffer
+            Get the source of the file, called on the first search.
+
+        all_names : bool
+            Whether to index all the names, otherwise only the names that
+            contain the local name of an import of the file.
+        """
+        self._files[path_id] = _LazyNames(fsource, all_names)
+
+    def remove_file(self, path_id):
+        """Remove the names of the file of path_id."""
+        self._files.pop(path_id, None)
+
+    def copy(self):
+        """Create a copy that is not affected by later add_file and remove_file, in O(1).
+
+        The names of each file are shared, they are found once for all the copies.
+        """
+        table = NameTable(self.paths)
+        table._files = self._files.copy()
+        return table
+
+    def version(self):
+        """An object that is replaced whenever the files change.
+
+        Compared by identity, see PersistentMap.version.
+        """
+        return self._files.version()
+
+    def num_items(self):
+        """Total number of occurrences in the files searched so far."""
+        return sum(names.count for names in self._files.values())
+
+    def memory_size(self):
+        """Approximate memory used by the table in bytes, not counting the paths."""
+        return approx_size(self._files)
+
+    def search(self, path, symbols):
+        """Find all the occurrences of symbols in a file.
+
+        Parameters
+        ----------
+        path : str
+            The file path.
+
+        symbols : list of str
+            The (dotted) symbols to search.
+
+        Returns
+        -------
+        results : list of Range
+            The ranges of the occurrences, sorted by position.
+        """
+        path_id = self.paths.lookup(path)
+        names = self._files.get(path_id) if path_id is not None else None
+        if names is None:
+            return []
+        part2names = names.get()
+        results = set()
+        for symbol in symbols:
+            for name, rows in part2names.get(symbol.split(".", 1)[0], ()):
+                for offset in _symbol_offsets(name, symbol):
+                    for i in range(0, len(rows), _RANGE_SIZE):
+                        line, col = rows[i], rows[i + 1] + offset
+                        results.add((line, col, col + len(symbol)))
+        return [Range(Position(line, start), Position(line, end))
+                for line, start, end in sorted(results)]
+
+
+class _LazyNames:
+    """The names of a python file, found in its source on the first use."""
+    __slots__ = ["_fsource", "_all_names", "_part2names", "count"]
+
+    def __init__(self, fsource, all_names):
+        self._fsource = fsource
+        self._all_names = all_names
+        self._part2names = None
+        self.count = 0
+
+    def get(self):
+        """Get the map from component to the list of (name, range array)."""
+        part2names = self._part2names
+        if part2names is not None:
+            return part2names
+        try:
+            source = self._fsource()
+        except (OSError, UnicodeDecodeError):
+            source = ""
+        names = None
+        if not self._all_names:
+            names = set(x.alias if x.alias else x.import_name
+                        for x in pattern.find_py_imports(source))
+        found = pattern.find_py_names(source, names) if names is None or names else []
+        name2rows = {}
+        for name, line, col in found:
+            rows = name2rows.get(name)
+            if rows is None:
+                rows = array("I")
+                name2rows[name] = rows
+            rows.extend((line, col, line, col + len(name)))
+        part2names = {}
+        for name, rows in name2rows.items():
+            for part in set(name.split(".")):
+                part2names.setdefault(part, []).append((name, rows))
+        self.count = len(found)
+        self._part2names = part2names
+        return part2names
+
+
+def _symbol_offsets(name, symbol):
+    """Offsets where symbol matches whole components of the dotted name."""
+    offsets = []
+    start = name.find(symbol)
+    while start != -1:
+        end = start + len(symbol)
+        if ((start == 0 or name[start - 1] == ".") and
+                (end == len(name) or name[end] == ".")):
+            offsets.append(start)
+        start = name.find(symbol, start + 1)
+    return offsets
+
+
+class _TrieNode:
+    __slots__ = ["children", "items"]
+
+    def __init__(self, children, items):
+        self.children = children
+        self.items = items
+
+
+class ExportTrie:
+    """Persistent prefix trie from Export.key_prefix to the exports.
+
+    The trie is immutable, add and remove return a new trie that shares
+    the untouched nodes, so a snapshot can hold it without copying.
+    Finding all the exports whose prefix covers a key is O(len(key)).
+    """
+    def __init__(self, root=None, counter=0):
+        self._root = root if root is not None else _TrieNode({}, ())
+        self._counter = counter
+
+    def _update(self, prefix, fupdate):
+        nodes = [self._root]
+        for char in prefix:
+            child = nodes[-1].children.get(char) if nodes[-1] is not None else None
+            nodes.append(child)
+        last = nodes[-1]
+        new_node = _TrieNode(dict(last.children) if last else {},
+                             fupdate(last.items if last else ()))
+        for i in range(len(prefix) - 1, -1, -1):
+            parent = nodes[i]
+            children = dict(parent.children) if parent else {}
+            if new_node.items or new_node.children:
+                children[prefix[i]] = new_node
+            else:
+                children.pop(prefix[i], None)
+            new_node = _TrieNode(children, parent.items if parent else ())
+        return new_node
+
+    def add(self, mod_path, export):
+        """Return a new trie with the export of mod_path added."""
+        item = (self._counter, mod_path, export)
+        return ExportTrie(self._update(export.key_prefix, lambda items: items + (item,)),
+                          self._counter + 1)
+
+    def remove(self, mod_path, export):
+        """Return a new trie with the export of mod_path removed."""
+        root = self._update(export.key_prefix,
+                            lambda items: tuple(x for x in items if x[1] != mod_path))
+        return ExportTrie(root, self._counter)
+
+    def match(self, key):
+        """Find all the (mod_path, export) whose key_prefix is a prefix of key."""
+        node = self._root
+        matches = list(node.items)
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                break
+            matches += node.items
+        matches.sort(key=lambda x: x[0])
+        return [(mod_path, export) for _, mod_path, export in matches]
+
+
+class IndexSnapshot:
+    """An immutable view of the workspace index.
+
+    Parameters
+    ----------
+    key2defs : PatternTable
+        Map from key to definitions.
+
+    key2refs : PatternTable
+        Map from key to references.
+
+    modpath2exports : PersistentMap
+        Map from python module path to its exports.
+
+    export_trie : ExportTrie
+        Prefix trie of the exports.
+
+    py_names : NameTable
+        Occurrences of the names in python files.
+
+    pyimport_resolver : PyImportResolver
+        The resolver state at the time of the snapshot.
+
+    generation : int
+        Increased by one with every published snapshot.
+    """
+    __slots__ = ["key2defs", "key2refs", "modpath2exports", "export_trie", "py_names",
+                 "pyimport_resolver", "generation"]
+
+    def __init__(self, key2defs, key2refs, modpath2exports, export_trie, py_names,
+                 pyimport_resolver, generation=0):
+        self.key2defs = key2defs
+        self.key2refs = key2refs
+        self.modpath2exports = modpath2exports
+        self.export_trie = export_trie
+        self.py_names = py_names
+        self.pyimport_resolver = pyimport_resolver
+        self.generation = generation
+
+    def python_version(self):
+        """An object that changes whenever the exports, the python names or the imports change.
+
+        The python references of any key depend on them. Compared by
+        equality, which compares the versions of the tables by identity.
+        """
+        return (self.export_trie, self.py_names.version(), self.pyimport_resolver.version())
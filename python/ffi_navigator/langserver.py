@@ -1,13 +1,25 @@
 """Language server using the navigator"""
-import argparse
 import logging
 import pathlib
 import attr
 import os
 import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from urllib.parse import urlparse, unquote
 from . import workspace, pattern, lsp, util
+from .document import DocumentStore
+from .query import QueryContext, QueryCache, LatencyStats, RequestCancelled
 from pyls_jsonrpc import dispatchers, endpoint, streams
+from pyls_jsonrpc.exceptions import JsonRpcRequestCancelled
+
+
+TEXT_DOCUMENT_SYNC_INCREMENTAL = 2
+FILE_CHANGE_DELETED = 3
+WATCH_KIND_DELETE = 4
+MESSAGE_TYPE_WARNING = 2
+CANCEL_METHOD = "$/cancelRequest"
 
 
 def uri2path(uri):
@@ -19,9 +31,13 @@ def uri2path(uri):
 def path2uri(path):
     return pathlib.Path(os.path.abspath(path)).as_uri()
 
-def pattern2loc(pattern_list):
+def pattern2loc(pattern_list, dupset=None):
+    """Convert patterns to serialized locations, drop the duplicated ones.
+
+    dupset can be shared by the calls of the batches of one result.
+    """
     results = []
-    dupset = set()
+    dupset = set() if dupset is None else dupset
     proc = lambda decl: lsp.Location(uri=path2uri(decl.path), range=decl.range)
     for x in pattern_list:
         x = proc(x)
@@ -32,98 +48,534 @@ def pattern2loc(pattern_list):
     return results
 
 
+class WorkDoneProgress:
+    """A work done progress initiated by the server.
+
+    The token is created by window/workDoneProgress/create, the progress
+    is only sent after the client accepts the token.
+
+    Parameters
+    ----------
+    endpoint : Endpoint
+        The JSON RPC endpoint.
+
+    token : str
+        The progress token.
+
+    title : str
+        The title of the progress.
+    """
+    def __init__(self, endpoint, token, title):
+        self.endpoint = endpoint
+        self.token = token
+        self.title = title
+        self._lock = threading.Lock()
+        self._state = "creating"
+        self._report = {}
+        future = endpoint.request("window/workDoneProgress/create", {"token": token})
+        future.add_done_callback(self._on_created)
+
+    def _on_created(self, future):
+        with self._lock:
+            if self._state != "creating":
+                return
+            if future.cancelled() or future.exception() is not None:
+                self._state = "failed"
+                return
+            self._state = "active"
+            self._notify(dict(kind="begin", title=self.title, **self._report))
+
+    def _notify(self, value):
+        self.endpoint.notify("$/progress", {"token": self.token, "value": value})
+
+    def report(self, message, percentage=None):
+        """Report the progress, only the latest report is kept before the token is created."""
+        with self._lock:
+            self._report = {"message": message}
+            if percentage is not None:
+                self._report["percentage"] = percentage
+            if self._state == "active":
+                self._notify(dict(kind="report", **self._report))
+
+    def end(self, message):
+        """End the progress."""
+        with self._lock:
+            if self._state == "active":
+                self._notify({"kind": "end", "message": message})
+            self._state = "ended"
+
+
 class BaseServer(dispatchers.MethodDispatcher):
-    """Base language server can be used for unittesting."""
-    def __init__(self):
+    """Base language server can be used for unittesting.
+
+    Parameters
+    ----------
+    cache_dir : Optional[str]
+        The directory of the index cache.
+
+    background_index : bool
+        Whether to index the workspace in the background.
+
+    query_budget : Optional[float]
+        Time budget in seconds of a query, the results found so far are returned
+        when it runs out. Can be overridden by initializationOptions.queryBudget.
+
+    query_workers : int
+        Number of threads to run the queries, so that the message loop can receive
+        $/cancelRequest meanwhile and a long query does not hold back the others.
+        The queries run in the message loop if 0.
+    """
+    # Seconds to wait for more watched file events before reindexing.
+    watched_files_debounce = 0.5
+    # Seconds to wait for more edits of the opened documents before reindexing.
+    did_change_debounce = 0.3
+    # Number of locations to collect before sending a partial result.
+    partial_result_batch = 64
+
+    def __init__(self, cache_dir=None, background_index=False,
+                 query_budget=None, query_workers=0):
         self.endpoint = None
         self.logger = logging
-        self.ws = workspace.Workspace()
+        self.ws = workspace.Workspace(cache_dir=cache_dir,
+                                      progress_callback=self._on_index_progress)
+        self.documents = DocumentStore()
+        self.query_budget = query_budget
+        self.query_cache = QueryCache()
+        self.latency = LatencyStats()
+        self._background_index = background_index
+        self._client_capabilities = {}
+        self._pending_changes = {}
+        self._pending_lock = threading.Lock()
+        self._flush_timer = None
+        self._changed_docs = {}
+        self._changed_docs_timer = None
+        self._reindex_lock = threading.Lock()
+        self._query_executor = (
+            ThreadPoolExecutor(max_workers=query_workers) if query_workers else None)
+        self._request_id = None
+        self._running_queries = {}
+        self._indexing = False
+        self._index_progress = None
+        self._index_work = None
+        self._index_lock = threading.Lock()
+
+    def consume(self, message):
+        """Consume a JSON RPC message from the client.
+
+        Track the id of the request being dispatched, and
+        cancel the running query on $/cancelRequest.
+        """
+        if message.get("method") == CANCEL_METHOD:
+            ctx = self._running_queries.get(message["params"]["id"])
+            if ctx is not None:
+                self.logger.info("%s %s", CANCEL_METHOD, message["params"]["id"])
+                ctx.cancel()
+            return
+        self._request_id = message.get("id")
+        try:
+            self.endpoint.consume(message)
+        finally:
+            self._request_id = None
+
+    def __getitem__(self, method):
+        handler = super().__getitem__(method)
+
+        def _timed(params):
+            tstart = time.perf_counter()
+            result = handler(params)
+            if isinstance(result, Future):
+                # the query runs in a worker thread, time it until the response
+                result.add_done_callback(
+                    lambda _: self.latency.record(method, time.perf_counter() - tstart))
+            else:
+                self.latency.record(method, time.perf_counter() - tstart)
+            return result
+        return _timed
+
+    def _run_query(self, method, fquery):
+        """Run fquery(ctx) as the query of the current request.
+
+        Returns the result, or a Future of it if the queries
+        run in the worker threads.
+        """
+        # the query sees the edits received before it
+        self.flush_changed_docs()
+        ctx = QueryContext(self.query_budget)
+        request_id = self._request_id
+
+        def _run():
+            try:
+                # the request can be cancelled before it starts
+                ctx.checkpoint()
+                result = fquery(ctx)
+            except RequestCancelled:
+                self.logger.info("%s cancelled", method)
+                raise JsonRpcRequestCancelled()
+            finally:
+                self._running_queries.pop(request_id, None)
+            if ctx.partial:
+                self.logger.warning("%s ran out of the time budget %ss, return %d partial results",
+                                    method, ctx.budget, len(result))
+                if self.endpoint is not None:
+                    self.endpoint.notify("window/showMessage", {
+                        "type": MESSAGE_TYPE_WARNING,
+                        "message": "ffi-navigator: %s results are partial, "
+                                   "the time budget of %ss ran out" % (method, ctx.budget)})
+            return result
+
+        if request_id is not None:
+            self._running_queries[request_id] = ctx
+        if self._query_executor is None:
+            return _run()
+        return self._query_executor.submit(_run)
+
+    def _cached_locations(self, key, versions, fquery, ctx=None):
+        """Get the serialized locations of the patterns returned by fquery().
+
+        The results are cached until the versions of the index they depend on
+        change, partial results are not cached.
+        """
+        res = self.query_cache.get(key, versions)
+        if res is None:
+            res = pattern2loc(fquery())
+            if ctx is None or not ctx.partial:
+                self.query_cache.put(key, versions, res)
+        return res
+
+    @staticmethod
+    def _key_refs_versions(snapshot, key):
+        # the indexed references of key, and the python references found by the imports
+        return (snapshot.key2refs.version(key), snapshot.python_version())
+
+    def _key_defs(self, key):
+        snapshot = self.ws.snapshot
+        return self._cached_locations(
+            ("key_defs", key), snapshot.key2defs.version(key),
+            lambda: snapshot.key2defs.get(key, []))
+
+    def _key_refs(self, key, ctx):
+        return self._cached_locations(
+            ("key_refs", key), self._key_refs_versions(self.ws.snapshot, key),
+            lambda: self.ws.find_refs(key, ctx), ctx)
 
     def m_initialize(self, **kwargs):
         self.logger.info("Initialize %s", kwargs)
+        self._client_capabilities = kwargs.get("capabilities", {})
+        options = kwargs.get("initializationOptions") or {}
+        self.query_budget = options.get("queryBudget", self.query_budget)
         rooturi = kwargs["rootUri"]
         if rooturi is not None:
             root_path = uri2path(kwargs["rootUri"])
-            self.ws.initialize(root_path)
+            with self._index_lock:
+                self._indexing = True
+                self._index_progress = None
+            self.ws.initialize(root_path, background=self._background_index)
         return {
             "capabilities": {
                 "definitionProvider": True,
-                "referencesProvider": True,
+                "referencesProvider": {"workDoneProgress": True},
+                "textDocumentSync": {
+                    "openClose": True,
+                    "change": TEXT_DOCUMENT_SYNC_INCREMENTAL,
+                    "save": {"includeText": False},
+                },
             }
         }
 
+    def _on_index_progress(self, kind, progress):
+        """Forward the workspace indexing progress to the client."""
+        with self._index_lock:
+            self._index_progress = progress
+            work = self._index_work
+            if kind == "end":
+                self._indexing = False
+                self._index_work = None
+        if work is None:
+            return
+        if kind == "end":
+            work.end("indexed " + progress.summary())
+        else:
+            percentage = (100 * progress.files_indexed // progress.files_discovered
+                          if progress.files_discovered else 0)
+            work.report(progress.summary(), percentage)
+
     def m_initialized(self, **kwargs):
-        pass
+        # progress can only be sent after the response of initialize
+        window_caps = self._client_capabilities.get("window", {})
+        if self.endpoint is not None and window_caps.get("workDoneProgress", False):
+            with self._index_lock:
+                if self._indexing:
+                    self._index_work = WorkDoneProgress(
+                        self.endpoint, "ffi-navigator-index", "Indexing")
+                    progress = self._index_progress
+                    if progress is not None:
+                        self._index_work.report(progress.summary())
+        watch_caps = self._client_capabilities.get(
+            "workspace", {}).get("didChangeWatchedFiles", {})
+        if self.endpoint is not None and watch_caps.get("dynamicRegistration", False):
+            self.endpoint.request("client/registerCapability", {
+                "registrations": [{
+                    "id": "ffi-navigator-watched-files",
+                    "method": "workspace/didChangeWatchedFiles",
+                    "registerOptions": {
+                        # a deleted directory does not match the file pattern
+                        "watchers": [{"globPattern": "**/*.{py,h,cc,cpp}"},
+                                     {"globPattern": "**/*", "kind": WATCH_KIND_DELETE}]
+                    }
+                }]
+            })
+
+    def m_workspace__did_change_watched_files(self, changes=None, **_kwargs):
+        with self._pending_lock:
+            for change in changes or []:
+                # later events of the same file override earlier ones
+                self._pending_changes[uri2path(change["uri"])] = change["type"]
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self._flush_timer = threading.Timer(
+                self.watched_files_debounce, self.flush_watched_files)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush_watched_files(self):
+        """Reindex the files collected from workspace/didChangeWatchedFiles as one batch."""
+        with self._pending_lock:
+            pending = self._pending_changes
+            self._pending_changes = {}
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        if not pending:
+            return
+        changed = [path for path, kind in pending.items() if kind != FILE_CHANGE_DELETED]
+        deleted = [path for path, kind in pending.items() if kind == FILE_CHANGE_DELETED]
+        self.logger.info("workspace/didChangeWatchedFiles reindex %d changed, %d deleted",
+                         len(changed), len(deleted))
+        self.ws.update_files(changed, deleted)
+
+    def m_text_document__did_open(self, textDocument=None, **_kwargs):
+        path = uri2path(textDocument["uri"])
+        if "text" in textDocument:
+            self.documents.open(path, textDocument["text"], textDocument.get("version"))
+        self.ws.prioritize(path)
+
+    def m_text_document__did_close(self, textDocument=None, **_kwargs):
+        path = uri2path(textDocument["uri"])
+        self.documents.close(path)
+        with self._reindex_lock:
+            self._discard_changed_doc(path)
+            # the index may hold unsaved edits, go back to the file on disk
+            if os.path.isfile(path):
+                self.ws.reindex_doc(path)
+            else:
+                self.ws.update_files([], [path])
+
+    def m_text_document__did_save(self, textDocument=None, text=None, **_kwargs):
+        path = uri2path(textDocument["uri"])
+        source = None
+        if text is not None:
+            source = self.documents.open(path, text, textDocument.get("version")).source
+        with self._reindex_lock:
+            self._discard_changed_doc(path)
+            if self.ws.reindex_doc(path, source):
+                self.logger.info("textDocument/didSave reindex %s", path)
+
+    def m_text_document__did_change(self, textDocument=None, contentChanges=None, **_kwargs):
+        path = uri2path(textDocument["uri"])
+        if not contentChanges:
+            return
+        doc = self.documents.change(path, contentChanges, textDocument.get("version"))
+        with self._pending_lock:
+            # only the last content of a document is reindexed
+            self._changed_docs[path] = doc.source
+            if self._changed_docs_timer is not None:
+                self._changed_docs_timer.cancel()
+            self._changed_docs_timer = threading.Timer(
+                self.did_change_debounce, self.flush_changed_docs)
+            self._changed_docs_timer.daemon = True
+            self._changed_docs_timer.start()
+
+    def _discard_changed_doc(self, path):
+        with self._pending_lock:
+            self._changed_docs.pop(path, None)
+
+    def flush_changed_docs(self):
+        """Reindex the documents changed by textDocument/didChange since the last flush."""
+        with self._reindex_lock:
+            with self._pending_lock:
+                pending = self._changed_docs
+                self._changed_docs = {}
+                if self._changed_docs_timer is not None:
+                    self._changed_docs_timer.cancel()
+                    self._changed_docs_timer = None
+            for path, source in pending.items():
+                self.ws.reindex_doc(path, source)
 
     def m_text_document__definition(self, **kwargs):
-        path = uri2path(kwargs["textDocument"]["uri"])
         self.logger.info("textDocument/definition %s", kwargs)
+        return self._run_query("textDocument/definition",
+                               lambda ctx: self._find_definition(ctx, **kwargs))
+
+    def _find_definition(self, ctx, **kwargs):
+        path = uri2path(kwargs["textDocument"]["uri"])
         pos = lsp.Position(**kwargs["position"])
-        source = open(path, encoding="utf-8").readlines()
+        source = self.documents.get(path).source
         sym = self.ws.extract_symbol(path, source, pos)
 
         if sym is None:
             self.logger.error("textDocument/definition cannot extract symbol, pos=%s, line=%s", pos, source[pos.line])
             return []
         if isinstance(sym, pattern.Symbol):
-            res = self.ws.find_defs(path, sym.value)
+            res = self._cached_locations(
+                ("defs", path, sym.value), self.ws.snapshot.generation,
+                lambda: self.ws.find_defs(path, sym.value))
         elif isinstance(sym, pattern.Ref):
-            res = self.ws.key2defs.get(sym.key, [])
+            res = self._key_defs(sym.key)
         else:
             return None
-        res = pattern2loc(res)
         self.logger.info("textDocument/definition return %s", res)
         return res
 
     def m_text_document__references(self, **kwargs):
-        path = uri2path(kwargs["textDocument"]["uri"])
         self.logger.info("textDocument/references %s", kwargs)
+        return self._run_query("textDocument/references",
+                               lambda ctx: self._find_references(ctx, **kwargs))
+
+    def _find_references(self, ctx, **kwargs):
+        path = uri2path(kwargs["textDocument"]["uri"])
         pos = lsp.Position(**kwargs["position"])
         include_decl = kwargs.get("includeDeclaration", True)
-        source = open(path, encoding="utf-8").readlines()
+        source = self.documents.get(path).source
         sym = self.ws.extract_symbol(path, source, pos)
 
+        if self.endpoint is not None and ("partialResultToken" in kwargs or
+                                          "workDoneToken" in kwargs):
+            return self._stream_references(ctx, path, sym, include_decl,
+                                           kwargs.get("partialResultToken"),
+                                           kwargs.get("workDoneToken"))
         defs, refs = [], []
         if isinstance(sym, pattern.Symbol):
             defs = self.ws.find_defs(path, sym.value)
             if defs:
-                refs = self.ws.find_refs(defs[0].key)
+                refs = self._key_refs(defs[0].key, ctx)
+            defs = pattern2loc(defs)
         elif isinstance(sym, pattern.Ref):
             if include_decl:
-                defs = self.ws.key2defs.get(sym.key, [])
-            refs = self.ws.find_refs(sym.key)
+                defs = self._key_defs(sym.key)
+            refs = self._key_refs(sym.key, ctx)
         elif isinstance(sym, pattern.Def):
             if include_decl:
-                defs = [sym]
-            refs = self.ws.find_refs(sym.key)
+                defs = pattern2loc([sym])
+            refs = self._key_refs(sym.key, ctx)
         else:
             self.logger.error("textDocument/references cannot extract symbol, pos=%s, line=%s", pos, source[pos.line])
             return []
-        res = (pattern2loc(defs) if include_decl else []) + pattern2loc(refs)
+        res = (defs if include_decl else []) + refs
         self.logger.info("textDocument/references return %s", res)
         return res
 
+    def _stream_references(self, ctx, path, sym, include_decl, partial_token, progress_token):
+        """Send the references in $/progress notifications as they are found.
+
+        With a partialResultToken the locations are sent in batches and the response
+        is empty, with a workDoneToken the number of references found is reported.
+        """
+        def _progress(token, value):
+            if token is not None:
+                self.endpoint.notify("$/progress", {"token": token, "value": value})
+
+        if isinstance(sym, pattern.Symbol):
+            defs = self.ws.find_defs(path, sym.value)
+            key = defs[0].key if defs else None
+            defs = pattern2loc(defs)
+        elif isinstance(sym, pattern.Ref):
+            key = sym.key
+            defs = self._key_defs(key) if include_decl else []
+        elif isinstance(sym, pattern.Def):
+            key = sym.key
+            defs = pattern2loc([sym])
+        else:
+            self.logger.error("textDocument/references cannot extract symbol, path=%s", path)
+            return []
+        versions = self._key_refs_versions(self.ws.snapshot, key) if key is not None else None
+
+        def _batches():
+            if key is None:
+                return
+            cached = self.query_cache.get(("key_refs", key), versions)
+            if cached is not None:
+                yield cached
+                return
+            indexed, found, dupset = [], [], set()
+            for from_index, group in self.ws.iter_refs(key, ctx):
+                (indexed if from_index else found).extend(group)
+                yield pattern2loc(group, dupset)
+            if not ctx.partial:
+                # same order as the results of find_refs
+                self.query_cache.put(("key_refs", key), versions, pattern2loc(found + indexed))
+
+        _progress(progress_token, {"kind": "begin", "title": "Finding references",
+                                   "cancellable": True})
+        results = list(defs) if include_decl else []
+        batch = list(results)
+        sent = False
+        for group in _batches():
+            results += group
+            batch += group
+            # the first results are sent right away
+            if not sent or len(batch) >= self.partial_result_batch:
+                _progress(partial_token, batch)
+                _progress(progress_token, {"kind": "report",
+                                           "message": "%d references" % len(results)})
+                batch = []
+                sent = True
+        if batch:
+            _progress(partial_token, batch)
+        _progress(progress_token, {"kind": "end", "message": "%d references" % len(results)})
+        self.logger.info("textDocument/references streamed %d locations", len(results))
+        return [] if partial_token is not None else results
+
+    def m_ffi_navigator__stats(self, **_kwargs):
+        """Custom request ffiNavigator/stats, the statistics of the index and the server."""
+        res = self.ws.stats()
+        res["query_cache"] = {"size": len(self.query_cache), "hits": self.query_cache.hits,
+                              "misses": self.query_cache.misses}
+        res["latency"] = self.latency.summary()
+        return res
+
 
 class StdIOServer(BaseServer):
     """The language server using stdio."""
-    def __init__(self, ifile, ofile):
-        super(StdIOServer, self).__init__()
+    def __init__(self, ifile, ofile, cache_dir=None, query_workers=4):
+        super(StdIOServer, self).__init__(cache_dir, background_index=True,
+                                          query_workers=query_workers)
         self._istream = streams.JsonRpcStreamReader(ifile)
         self._ostream = streams.JsonRpcStreamWriter(ofile)
         self.endpoint = endpoint.Endpoint(self, self._ostream.write)
 
     def run_ioloop(self):
         """Run the ioloop of the server by consuming inputs."""
-        self._istream.listen(self.endpoint.consume)
+        self._istream.listen(self.consume)
 
     def m_exit(self):
+        if self._query_executor is not None:
+            self._query_executor.shutdown(wait=False)
         self.endpoint.shutdown()
         self._istream.close()
         self._ostream.close()
 
 
+def default_cache_dir():
+    """The directory to persist the index, can be overriden by FFI_NAVIGATOR_CACHE_DIR."""
+    cache_dir = os.environ.get("FFI_NAVIGATOR_CACHE_DIR", None)
+    if cache_dir is not None:
+        return cache_dir if cache_dir else None
+    return os.path.join(os.path.expanduser("~"), ".cache", "ffi-navigator")
+
+
 def main():
-    StdIOServer(sys.stdin.buffer, sys.stdout.buffer).run_ioloop()
+    StdIOServer(sys.stdin.buffer, sys.stdout.buffer,
+                cache_dir=default_cache_dir()).run_ioloop()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format="[%(asctime)-15s] %(message)s")
@@ -2,9 +2,12 @@
 from typing import Optional
 
 import re
+import time
+import functools
 import attr
-import numpy as np
 from bisect import bisect
+from itertools import accumulate, repeat
+from operator import add
 
 from .lsp import Range, Position, Location
 
@@ -79,6 +82,37 @@ class Export(Pattern):
     fkey2var = attr.ib()
     fvar2key = attr.ib()
 
+
+def _add_prefix(prefix, value):
+    return prefix + value
+
+
+def _remove_prefix(prefix, value):
+    return value[len(prefix):]
+
+
+def prefix_export(key_prefix, path, var_prefix):
+    """Create an Export whose keys are var_prefix + var.
+
+    Unlike lambdas, the created mapping functions can be pickled,
+    which allows the exports to be stored in the index cache.
+
+    Parameters
+    ----------
+    key_prefix : str
+        The prefix of keys to be exported.
+
+    path : str
+        The file path to be exported.
+
+    var_prefix : str
+        The part of the key to strip to obtain the local var name.
+    """
+    return Export(key_prefix=key_prefix, path=path,
+                  fkey2var=functools.partial(_remove_prefix, var_prefix),
+                  fvar2key=functools.partial(_add_prefix, var_prefix))
+
+
 @attr.s
 class Symbol(Pattern):
     """A symbol in python expression, can contain dot.
@@ -86,7 +120,350 @@ class Symbol(Pattern):
     value : str = attr.ib()
 
 
-def re_matcher(rexpr, fcreate, use_search=False):
+class SourceBuffer:
+    """Source code of a file, holds the text once with a lazily built line offset index.
+
+    A SourceBuffer can be used in place of the list of lines of the source.
+
+    Parameters
+    ----------
+    source : str or list of str
+        The source text, or its lines with or without the line breaks.
+    """
+    def __init__(self, source):
+        if isinstance(source, str):
+            self._text = source
+            self._lines = None
+            self._sep = ""
+        else:
+            self._text = None
+            self._lines = source
+            # lines without line breaks are joined by "\n" to keep the line boundaries
+            self._sep = "" if not source or source[0].endswith("\n") else "\n"
+        self._line_starts = None
+
+    @staticmethod
+    def wrap(source):
+        """Create a SourceBuffer of source unless it is already one."""
+        return source if isinstance(source, SourceBuffer) else SourceBuffer(source)
+
+    @property
+    def text(self):
+        """The whole source text."""
+        if self._text is None:
+            self._text = self._sep.join(self._lines)
+        return self._text
+
+    @property
+    def lines(self):
+        """The lines of the source, including the line breaks for str sources."""
+        if self._lines is None:
+            parts = self._text.split("\n")
+            lines = [x + "\n" for x in parts[:-1]]
+            if parts[-1]:
+                lines.append(parts[-1])
+            self._lines = lines
+            self._sep = ""
+        return self._lines
+
+    @property
+    def line_starts(self):
+        """Offsets of the beginning of each line, followed by the end of the text."""
+        if self._line_starts is None:
+            lengths = map(len, self.lines)
+            if self._sep:
+                lengths = map(add, lengths, repeat(len(self._sep)))
+            self._line_starts = [0] + list(accumulate(lengths))
+        return self._line_starts
+
+    def line_of(self, offset):
+        """Get the line number of a text offset."""
+        return bisect(self.line_starts, offset) - 1
+
+    def position(self, offset):
+        """Get the position of a text offset."""
+        line = self.line_of(offset)
+        return Position(line, offset - self._line_starts[line])
+
+    def __getstate__(self):
+        # only the text is sent to the extraction workers
+        return self.text
+
+    def __setstate__(self, text):
+        self.__init__(text)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, line):
+        return self.lines[line]
+
+    def __iter__(self):
+        return iter(self.lines)
+
+
+RE_GROUP_NAME = re.compile(r"\(\?P<[A-Za-z_][A-Za-z0-9_]*>")
+
+
+def _line_probe(rexpr):
+    """Loosen a line pattern into a probe that is searched over the whole text.
+
+    The probe matches in every line that rexpr matches. Group names, anchors and
+    leading whitespace or wildcards are dropped so that the probe starts with the
+    distinctive part of the pattern, which the regexp engine can skip to quickly.
+    """
+    rexpr = RE_GROUP_NAME.sub("(?:", rexpr).replace("\\Z", "$")
+    for prefix in ("\\s*", ".*"):
+        while rexpr.startswith(prefix):
+            rexpr = rexpr[len(prefix):]
+    return rexpr
+
+
+@attr.s
+class MatcherStats:
+    """Counters of the literal prefilter and the matching time of a matcher.
+
+    Parameters
+    ----------
+    file_skips : int
+        Number of sources skipped because none of the literals occur.
+
+    file_scans : int
+        Number of sources scanned.
+
+    line_skips : int
+        Number of lines in the scanned sources that are skipped.
+
+    line_checks : int
+        Number of lines checked by the regexp of the matcher.
+
+    line_hits : int
+        Number of checked lines that produced results.
+
+    matches : int
+        Number of results produced.
+
+    seconds : float
+        Cumulative time spent in the prefilter and the regexps of the matcher.
+    """
+    file_skips : int = attr.ib(default=0)
+    file_scans : int = attr.ib(default=0)
+    line_skips : int = attr.ib(default=0)
+    line_checks : int = attr.ib(default=0)
+    line_hits : int = attr.ib(default=0)
+    matches : int = attr.ib(default=0)
+    seconds : float = attr.ib(default=0.0)
+
+    def merge(self, other):
+        """Add the counters of other, e.g. collected in another process."""
+        for field in attr.fields(MatcherStats):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+
+class Matcher:
+    """Base class of matchers.
+
+    Parameters
+    ----------
+    literals : Optional[list of str]
+        Substrings that a match must contain at least one of,
+        None if the matcher cannot be prefiltered.
+    """
+    def __init__(self, literals):
+        self.literals = tuple(literals) if literals else None
+        self.stats = MatcherStats()
+
+    def accept(self, text, start=0, stop=None):
+        """Check whether the matcher can match anything in text[start:stop], update the counters."""
+        tstart = time.perf_counter()
+        accepted = self.literals is None or any(
+            text.find(x, start, stop) != -1 for x in self.literals)
+        self.stats.seconds += time.perf_counter() - tstart
+        if accepted:
+            self.stats.file_scans += 1
+            return True
+        self.stats.file_skips += 1
+        return False
+
+
+class LineMatcher(Matcher):
+    """Matcher that matches each line of the source independently.
+
+    Parameters
+    ----------
+    probe : str
+        A regexp that matches in every line the matcher can match,
+        used to find the candidate lines when there are no literals.
+
+    fmatch : Function (path, source, lines) -> list of (line, results).
+        Match each of the given lines of the SourceBuffer independently,
+        only the lines that produced results are returned, in the given order.
+
+    literals : Optional[list of str]
+        Substrings that a matching line must contain at least one of.
+    """
+    def __init__(self, probe, fmatch, literals=None):
+        super().__init__(literals)
+        self.probe = probe
+        self.fmatch = fmatch
+        self._scanner = fused_matcher([self])
+
+    def __call__(self, path, source, begin_line=0, end_line=None):
+        return self._scanner(path, source, begin_line, end_line)
+
+
+class MultiLineMatcher(Matcher):
+    """Matcher that matches the source text, a match can span multiple lines.
+
+    Parameters
+    ----------
+    fmatch : Function (path, source, begin_line, end_line) -> iterator of results.
+        Match the SourceBuffer, only yield the matches that overlap
+        the lines in [begin_line, end_line).
+
+    literals : Optional[list of str]
+        Substrings that a matching source must contain at least one of.
+
+    context : int
+        The maximum number of lines a match can span, a window is
+        extended by context lines on both sides before matching.
+    """
+    def __init__(self, fmatch, literals=None, context=8):
+        super().__init__(literals)
+        self.fmatch = fmatch
+        self.context = context
+        self._scanner = fused_matcher([self])
+
+    def __call__(self, path, source, begin_line=0, end_line=None):
+        return self._scanner(path, source, begin_line, end_line)
+
+
+def _context_window(source, begin_line, end_line, context):
+    """Get the text offsets of lines [begin_line, end_line) extended by context lines."""
+    line_starts = source.line_starts
+    return (line_starts[max(begin_line - context, 0)],
+            line_starts[min(end_line + context, len(line_starts) - 1)])
+
+
+def _literal_lines(source, literals, start, stop):
+    """Find the lines in source.text[start:stop] that contain one of the literals."""
+    text = source.text
+    line_starts = source.line_starts
+    lines = set()
+    for literal in literals:
+        pos = text.find(literal, start, stop)
+        while pos != -1:
+            line = bisect(line_starts, pos) - 1
+            lines.add(line)
+            pos = text.find(literal, line_starts[line + 1], stop)
+    return lines
+
+
+def _probe_lines(trigger, source, start, stop):
+    """Find the lines in source.text[start:stop] where trigger matches."""
+    text = source.text
+    line_starts = source.line_starts
+    lines = []
+    match = trigger(text, start, stop)
+    while match:
+        line = bisect(line_starts, match.start()) - 1
+        lines.append(line)
+        match = trigger(text, line_starts[line + 1], stop)
+    return lines
+
+
+def fused_matcher(matchers):
+    """Fuse matchers into a single scanner that passes over the source once.
+
+    A matcher is skipped if none of its literals occur in the source. Otherwise
+    its candidate lines are the lines that contain one of its literals, found with
+    str.find on the whole text. The probes of the matchers without literals are
+    merged into one regexp that is searched over the whole text. Only the candidate
+    lines are dispatched to the line matchers, the multi-line matchers share
+    the joined text.
+
+    When a window of lines is given, both the literal prefilter and the regexps
+    only look at the window, the multi-line matchers also look at their context
+    lines around it, so the cost is O(window) rather than O(file).
+
+    The counters and the time of each matcher are accumulated in its stats,
+    the time of the shared probe regexp is not attributed to any matcher.
+
+    Parameters
+    ----------
+    matchers : list of LineMatcher or MultiLineMatcher
+        The matchers to fuse.
+
+    Returns
+    -------
+    scanner : Function (path, source, begin_line=0, end_line=None) -> list of results.
+        The line matchers only scan the lines in [begin_line, end_line),
+        the multi-line matchers return the matches that overlap these lines.
+    """
+    line_matchers = [x for x in matchers if isinstance(x, LineMatcher)]
+    multi_matchers = [x for x in matchers if isinstance(x, MultiLineMatcher)]
+    probes = [x.probe for x in line_matchers if x.literals is None]
+    trigger = re.compile("|".join(probes), re.MULTILINE).search if probes else None
+
+    def _scanner(path, source, begin_line=0, end_line=None):
+        source = SourceBuffer.wrap(source)
+        text = source.text
+        end_line = min(end_line, len(source)) if end_line else len(source)
+        begin_line = min(begin_line, end_line)
+        start = source.line_starts[begin_line]
+        stop = source.line_starts[end_line]
+        active = [x for x in line_matchers if x.accept(text, start, stop)]
+        results = []
+        if active:
+            # the candidate lines of each matcher, in increasing order
+            index2lines = []
+            probe_lines = None
+            for matcher in active:
+                if matcher.literals is None:
+                    if probe_lines is None:
+                        probe_lines = _probe_lines(trigger, source, start, stop)
+                    index2lines.append(probe_lines)
+                    continue
+                tstart = time.perf_counter()
+                index2lines.append(
+                    sorted(_literal_lines(source, matcher.literals, start, stop)))
+                matcher.stats.seconds += time.perf_counter() - tstart
+            # each matcher checks all of its candidate lines in one call,
+            # so that the bookkeeping is per matcher rather than per line
+            found = []
+            for index, matcher in enumerate(active):
+                lines = index2lines[index]
+                tstart = time.perf_counter()
+                hits = matcher.fmatch(path, source, lines)
+                stats = matcher.stats
+                stats.seconds += time.perf_counter() - tstart
+                stats.line_checks += len(lines)
+                stats.line_skips += end_line - begin_line - len(lines)
+                stats.line_hits += len(hits)
+                num_results = len(results)
+                for _, items in hits:
+                    results += items
+                stats.matches += len(results) - num_results
+                found.append(hits)
+            if len(found) > 1:
+                # order the results by line, then by matcher
+                merged = [(line, index, items) for index, hits in enumerate(found)
+                          for line, items in hits]
+                merged.sort(key=lambda x: x[:2])
+                results = [item for _, _, items in merged for item in items]
+        for matcher in multi_matchers:
+            if matcher.accept(text, *_context_window(source, begin_line, end_line,
+                                                     matcher.context)):
+                tstart = time.perf_counter()
+                items = list(matcher.fmatch(path, source, begin_line, end_line))
+                matcher.stats.seconds += time.perf_counter() - tstart
+                matcher.stats.matches += len(items)
+                results += items
+        return results
+    return _scanner
+
+
+def re_matcher(rexpr, fcreate, use_search=False, probe=None, literals=None):
     """
     Parameters
     ----------
@@ -97,29 +474,32 @@ def re_matcher(rexpr, fcreate, use_search=False):
 
     use_search: bool
          Whether use search
-    """
-    rexpr = re.compile(rexpr)
 
-    def _matcher(path, source, begin_line=0, end_line=None):
-        source = source.split("\n") if isinstance(source, str) else source
-        results = []
-        end_line = min(end_line, len(source)) if end_line else len(source)
-        for line in range(begin_line, end_line):
-            content = source[line]
-            match = rexpr.search(content) if use_search else rexpr.match(content)
+    probe : Optional[str]
+         The probe of the LineMatcher, derived from rexpr if not given.
+
+    literals : Optional[list of str]
+         Substrings that a matching line must contain at least one of.
+    """
+    compiled = re.compile(rexpr)
+    fmatch = compiled.search if use_search else compiled.match
+
+    def _match_lines(path, source, lines):
+        content = source.lines
+        hits = []
+        for line in lines:
+            match = fmatch(content[line])
             if match:
                 start, end = match.span()
-                start_pos = Position(line, start)
-                end_pos = Position(line, end)
                 item = fcreate(match, path,
-                               Range(start_pos, end_pos))
+                               Range(Position(line, start), Position(line, end)))
                 if item:
-                    results.append(item)
-        return results
-    return _matcher
+                    hits.append((line, [item]))
+        return hits
+    return LineMatcher(probe if probe else _line_probe(rexpr), _match_lines, literals)
 
 
-def re_multi_line_matcher(rexpr, fcreate):
+def re_multi_line_matcher(rexpr, fcreate, literals=None, context=8):
     """ Matches a pattern spanning multiple lines
 
     Parameters
@@ -128,32 +508,25 @@ def re_multi_line_matcher(rexpr, fcreate):
         A regexp pattern to match.
 
     fcreate : Function (match, path, range) -> result.
+
+    literals : Optional[list of str]
+        Substrings that a matching source must contain at least one of.
+
+    context : int
+        The maximum number of lines a match can span.
     """
     rexpr = re.compile(rexpr)
 
-    def _matcher(path, lines):
-        source = "".join(lines)
-        matches = list(rexpr.finditer(source))
-        if matches == []:
-            return []
-        line_counts = map(lambda line: len(line), lines)
-        cumsum = np.cumsum(list(line_counts))
-
-        # find line num, start and end pos for each match
-        next_begin = 0
-        result = []
-        for match in matches:
-            line_num_start = bisect(cumsum[next_begin:], match.start()) + next_begin
-            next_begin = line_num_start
-            line_num_end = line_num_start + match.group().count("\n")
-            pos_start = match.start() - int(cumsum[line_num_start-1])
-            pos_end = match.end() - int(cumsum[line_num_end-1])
-            assert(pos_start >= 0 and pos_end >= 0)
-            rg = Range(Position(line_num_start, pos_start), Position(line_num_end, pos_end))
-            result.append(fcreate(match, path, rg))
-
-        return result
-    return _matcher
+    def _match_text(path, source, begin_line, end_line):
+        start = source.line_starts[begin_line]
+        stop = source.line_starts[end_line]
+        for match in rexpr.finditer(source.text,
+                                    *_context_window(source, begin_line, end_line, context)):
+            if match.start() >= stop or match.end() < start:
+                continue
+            rg = Range(source.position(match.start()), source.position(match.end()))
+            yield fcreate(match, path, rg)
+    return MultiLineMatcher(_match_text, literals, context)
 
 
 def re_match_pybind_class():
@@ -161,13 +534,15 @@ def re_match_pybind_class():
                                  r"\s*\(\s*m,\s*\"(?P<key>[A-Za-z0-9|_]+)\""
                                  r"(,\s*[A-Za-z0-9|_|::|<|>|(|)]+)*\)",
                                  lambda match, path, rg: \
-                                 Def(key=match.group("key"), path=path, range=rg))
+                                 Def(key=match.group("key"), path=path, range=rg),
+                                 literals=["py::class_"])
 
 
 def re_match_pybind_method():
     return re_multi_line_matcher(r"\.def\(\s*\"(?P<key>[a-z0-9|_]+)\"",
                                  lambda match, path, rg: \
-                                 Def(key=match.group("key"), path=path, range=rg))
+                                 Def(key=match.group("key"), path=path, range=rg),
+                                 literals=[".def("])
 
 
 def macro_matcher(macro_names, fcreate=None):
@@ -187,7 +562,8 @@ def macro_matcher(macro_names, fcreate=None):
         return fcreate(match.group("skey"), path,
                        rg,
                        match.group("macro_name"))
-    return re_matcher(rexpr, _fcreate)
+    probe = "|".join(re.escape(x) + r"\(\"" for x in macro_names)
+    return re_matcher(rexpr, _fcreate, probe=probe, literals=macro_names)
 
 
 def def_matcher(def_names, fcreate=None):
@@ -207,7 +583,7 @@ def def_matcher(def_names, fcreate=None):
         return fcreate(match.group("skey"), path,
                        rg,
                        match.group("def_name"))
-    return re_multi_line_matcher(rexpr, _fcreate)
+    return re_multi_line_matcher(rexpr, _fcreate, literals=["." + x + "(" for x in def_names])
 
 
 def func_get_searcher(func_names, fcreate=None, *, allow_extra_args=False):
@@ -227,30 +603,25 @@ def func_get_searcher(func_names, fcreate=None, *, allow_extra_args=False):
     if not allow_extra_args:
         rexpr += r"\)"
 
-    rexpr = re.compile(rexpr)
+    compiled = re.compile(rexpr)
 
-    def _matcher(path, source, begin_line=0, end_line=None):
-        source = source.split("\n") if isinstance(source, str) else source
-        results = []
-        end_line = min(end_line, len(source)) if end_line else len(source)
-        for line in range(begin_line, end_line):
-            content = source[line]
-            str_pos = 0
-            while True:
-                match = rexpr.search(content, str_pos)
-                if not match:
-                    break
+    def _match_lines(path, source, lines):
+        content = source.lines
+        hits = []
+        for line in lines:
+            items = []
+            for match in compiled.finditer(content[line]):
                 start, end = match.span("skey")
-                start_pos = Position(line, start)
-                end_pos = Position(line, end)
                 item = fcreate(match.group("skey"), path,
-                               Range(start_pos, end_pos),
+                               Range(Position(line, start), Position(line, end)),
                                match.group("func_name"))
                 if item:
-                    results.append(item)
-                str_pos = match.end()
-        return results
-    return _matcher
+                    items.append(item)
+            if items:
+                hits.append((line, items))
+        return hits
+    probe = "|".join(re.escape(x) + r"\(\"" for x in func_names)
+    return LineMatcher(probe, _match_lines, literals=func_names)
 
 
 def decorator_matcher(func_names, keyword, fcreate=None):
@@ -269,38 +640,35 @@ def decorator_matcher(func_names, keyword, fcreate=None):
     decorator += "))((\(\"(?P<skey>[^\"]+)\")|(\s*\Z))"
     nextline = keyword + r"\s+(?P<skey>[a-zA-Z_0-9]+)\("
 
+    probe = "|".join(re.escape(x) for x in func_names)
     decorator = re.compile(decorator)
     nextline = re.compile(nextline)
 
-    def _matcher(path, source, begin_line=0, end_line=None):
-        source = source.split("\n") if isinstance(source, str) else source
-        results = []
-        end_line = min(end_line, len(source)) if end_line else len(source)
-        for line in range(begin_line, end_line):
-            content = source[line]
-            match = decorator.match(content)
-
-            if match:
-                skey = match.group("skey")
-                if skey:
-                    start, end = match.span("skey")
-                    lineno = line
-                if not skey and line + 1 < len(source):
-                    match_name = nextline.match(source[line + 1])
-                    if match_name:
-                        skey = match_name.group("skey")
-                        start, end = match_name.span("skey")
-                        lineno = line + 1
-                if skey:
-                    start_pos = Position(lineno, start)
-                    end_pos = Position(lineno, end)
-                    item = fcreate(skey, path,
-                                Range(start_pos, end_pos),
-                                   match.group("decorator"))
-                    if item:
-                        results.append(item)
-        return results
-    return _matcher
+    def _match_lines(path, source, lines):
+        content = source.lines
+        hits = []
+        for line in lines:
+            match = decorator.match(content[line])
+            if not match:
+                continue
+            skey = match.group("skey")
+            if skey:
+                start, end = match.span("skey")
+                lineno = line
+            if not skey and line + 1 < len(content):
+                match_name = nextline.match(content[line + 1])
+                if match_name:
+                    skey = match_name.group("skey")
+                    start, end = match_name.span("skey")
+                    lineno = line + 1
+            if skey:
+                item = fcreate(skey, path,
+                               Range(Position(lineno, start), Position(lineno, end)),
+                               match.group("decorator"))
+                if item:
+                    hits.append((line, [item]))
+        return hits
+    return LineMatcher(probe, _match_lines, literals=func_names)
 
 
 @attr.s
@@ -315,7 +683,7 @@ RE_PY_IMPORT_ITEM = re.compile(r"\s+(?P<name>[^\s]+)(\s+as\s+(?P<alias>[^\s]+))?
 
 def find_py_imports(source):
     """Discover python import information."""
-    source = source.split("\n") if isinstance(source, str) else source
+    source = SourceBuffer.wrap(source)
     results = []
     for line, content in enumerate(source):
         prefix = RE_PY_IMPORT_PREFIX.match(content)
@@ -334,7 +702,7 @@ RE_PY_DELIM = r"(\s|[.,\(\)\[\]{}:=\+\-\*]|\Z)+"
 
 def search_symbol(source,  symbols):
     """Search symbols within a source, return matched positions."""
-    source = source.split("\n") if isinstance(source, str) else source
+    source = SourceBuffer.wrap(source)
     rexpr = RE_PY_DELIM + "(?P<name>("
     rexpr += "|".join([re.escape(sym) for sym in symbols]) + "))"
     rexpr += RE_PY_DELIM
@@ -351,12 +719,49 @@ def search_symbol(source,  symbols):
     return results
 
 
+RE_PY_NAME = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*(\.[a-zA-Z_][a-zA-Z0-9_]*)*")
+
+def find_py_names(source, names=None):
+    """Find all the (dotted) names in a python source.
+
+    Parameters
+    ----------
+    source : list of str or str
+        The source code.
+
+    names : Optional[set of str]
+        Only report the dotted names that contain one of the names as a component.
+        Only the lines that contain one of the names are scanned, found
+        by the same literal prefilter as the matchers.
+
+    Returns
+    -------
+    results : list of (str, int, int)
+        The dotted name, line and column of each occurrence.
+    """
+    source = SourceBuffer.wrap(source)
+    text = source.text
+    line_starts = source.line_starts
+    if names is None:
+        lines = range(len(source))
+    else:
+        lines = sorted(_literal_lines(source, names, 0, len(text)))
+    results = []
+    for line in lines:
+        start = line_starts[line]
+        for match in RE_PY_NAME.finditer(text, start, line_starts[line + 1]):
+            name = match.group(0)
+            if names is None or any(x in names for x in name.split(".")):
+                results.append((name, line, match.start() - start))
+    return results
+
+
 RE_PY_NAMESPACE_PREFIX = re.compile(r"[a-zA-Z_][a-zA-Z0-9_.]+\Z")
 RE_PY_VAR_NAME = re.compile(r"[a-zA-Z0-9_.]+")
 
 def extract_symbol(source, pos: Position):
     """Find the complete expression, include namespace prefix"""
-    source = source.split("\n") if isinstance(source, str) else source
+    source = SourceBuffer.wrap(source)
     content = source[pos.line]
     mprefix = RE_PY_NAMESPACE_PREFIX.search(content, 0, pos.character)
     start = mprefix.start() if mprefix else pos.character
@@ -0,0 +1,141 @@
+"""Cooperative cancellation, time budget, result cache and latency of the queries."""
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class RequestCancelled(Exception):
+    """The query is cancelled by the client."""
+
+
+class QueryContext:
+    """State of a running query, checked at the checkpoints of the query.
+
+    A cancelled query raises RequestCancelled at the next checkpoint,
+    a query that runs out of its time budget stops gathering results
+    and returns the results found so far, marked as partial.
+
+    Parameters
+    ----------
+    budget : Optional[float]
+        The time budget in seconds, no limit if None.
+    """
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.deadline = time.monotonic() + budget if budget is not None else None
+        self.partial = False
+        self._cancelled = False
+
+    def cancel(self):
+        """Request the query to stop, can be called from another thread."""
+        self._cancelled = True
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def checkpoint(self):
+        """Check the state of the query.
+
+        Returns
+        -------
+        proceed : bool
+            False if the time budget has run out, the query
+            should then return the results gathered so far.
+        """
+        if self._cancelled:
+            raise RequestCancelled()
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.partial = True
+            return False
+        return True
+
+
+class QueryCache:
+    """LRU cache of query results.
+
+    Each result is stored with the versions of the index it is computed
+    from, e.g. the versions of the patterns of a key, and is only returned
+    while they compare equal, so the results that an update of the index
+    does not touch stay cached.
+
+    Parameters
+    ----------
+    capacity : int
+        The maximum number of results to keep.
+    """
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, versions):
+        """Get the result of key computed from versions, None if not cached."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] != versions:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, versions, value):
+        """Store the result of key computed from versions."""
+        with self._lock:
+            self._items[key] = (versions, value)
+            self._items.move_to_end(key)
+            if len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class LatencyStats:
+    """Latency percentiles of the requests, per method.
+
+    Only the latest samples of each method are kept for the percentiles.
+
+    Parameters
+    ----------
+    max_samples : int
+        The maximum number of samples to keep per method.
+    """
+    def __init__(self, max_samples=1024):
+        self.max_samples = max_samples
+        self._samples = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, method, seconds):
+        """Record the latency of a request of method."""
+        with self._lock:
+            samples = self._samples.get(method)
+            if samples is None:
+                samples = deque(maxlen=self.max_samples)
+                self._samples[method] = samples
+            samples.append(seconds)
+            self._counts[method] = self._counts.get(method, 0) + 1
+
+    def summary(self):
+        """Get the latency percentiles in milliseconds.
+
+        Returns
+        -------
+        summary : dict of str to dict
+            Map from method to its request count and p50, p90, p99, max latency.
+        """
+        with self._lock:
+            items = [(method, sorted(samples)) for method, samples in self._samples.items()]
+            counts = dict(self._counts)
+        results = {}
+        for method, samples in items:
+            def _percentile(q):
+                return samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+            results[method] = {"count": counts[method], "p50": _percentile(0.5),
+                               "p90": _percentile(0.9), "p99": _percentile(0.99),
+                               "max": samples[-1] * 1000}
+        return results
@@ -0,0 +1,68 @@
+"""Directory scanner that collects source files in a single walk."""
+import os
+
+
+def scan_dir(dirname, extensions, visited=None):
+    """Walk a directory once and group the files by extension.
+
+    Hidden files and directories are skipped. Symlinked directories are
+    followed, the real path of every directory and file is recorded in
+    visited so that symlink loops and overlapping scans do not produce
+    the same file twice.
+
+    Parameters
+    ----------
+    dirname : str
+        The directory to scan.
+
+    extensions : list of str
+        The file extensions to collect, e.g. [".py", ".cc"].
+
+    visited : Optional[set]
+        Real paths that are already scanned, updated in place.
+
+    Returns
+    -------
+    files : dict of str to list of (str, os.stat_result)
+        Map from extension to the sorted list of (path, stat).
+    """
+    visited = set() if visited is None else visited
+    files = {ext: [] for ext in extensions}
+    if not os.path.isdir(dirname):
+        return files
+    dirname = os.path.abspath(dirname)
+    stack = [(dirname, os.path.realpath(dirname))]
+    while stack:
+        curr_dir, real_dir = stack.pop()
+        if real_dir in visited:
+            continue
+        visited.add(real_dir)
+        try:
+            entries = list(os.scandir(curr_dir))
+        except OSError:
+            continue
+        for item in entries:
+            if item.name.startswith("."):
+                continue
+            try:
+                is_dir = item.is_dir()
+            except OSError:
+                continue
+            is_link = item.is_symlink()
+            real_path = (os.path.realpath(item.path) if is_link
+                         else os.path.join(real_dir, item.name))
+            if is_dir:
+                stack.append((item.path, real_path))
+                continue
+            ext = os.path.splitext(item.name)[1]
+            if ext not in files or real_path in visited:
+                continue
+            try:
+                stat = item.stat()
+            except OSError:
+                continue
+            visited.add(real_path)
+            files[ext].append((item.path, stat))
+    for items in files.values():
+        items.sort(key=lambda x: x[0])
+    return files
@@ -1,4 +1,6 @@
+import io
 import sys
+import types
 from pathlib import Path
 
 
@@ -17,3 +19,42 @@ def join_path(root_path, relative_path):
 def normalize_path(raw_path):
     """Convert a unix file path to platform specific one"""
     return join_path("", raw_path)
+
+
+def normalize_text(text):
+    """Translate the line breaks of text to "\\n", same as read() in text mode."""
+    return io.StringIO(text, newline=None).read()
+
+
+def decode_text(data):
+    """Decode raw file content into text, same as read() in text mode."""
+    return normalize_text(data.decode("utf-8"))
+
+
+def approx_size(obj):
+    """Approximate the memory used by obj and the objects it holds, in bytes.
+
+    Objects reachable more than once are counted once,
+    types, modules and functions are not counted.
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(
+                item, (type, types.ModuleType, types.FunctionType)):
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, "__dict__"):
+            stack.append(vars(item))
+        else:
+            stack.extend(getattr(item, name) for name in getattr(item, "__slots__", ())
+                         if hasattr(item, name))
+    return total
@@ -1,55 +1,269 @@
-import glob
+import contextlib
+import functools
 import os
 import logging
+import sys
+import threading
+import time
+import attr
 from . import pattern
 from .import_resolver import PyImportResolver
+from .query import QueryContext
+from .index import (PatternTable, StringTable, NameTable, ExportTrie, PersistentMap,
+                    IndexSnapshot, encode_patterns, KIND_DEF)
 from .dialect import autodetect_dialects
-from .util import join_path
+from .scanner import scan_dir
+from .util import decode_text, approx_size
 
 
-def _append_dict(sdict, key, value):
-    if key in sdict:
-        sdict[key].append(value)
-    else:
-        sdict[key] = [value]
+_SOURCE_EXTS = (".py", ".h", ".cc", ".cpp")
+
+
+def _load_source(path, source):
+    if source is None:
+        with open(path, encoding="utf-8") as fi:
+            return pattern.SourceBuffer(fi.read())
+    if isinstance(source, bytes):
+        return pattern.SourceBuffer(decode_text(source))
+    return pattern.SourceBuffer.wrap(source)
+
+
+# States of the extraction worker process.
+_worker_providers = []
+
+
+def _worker_init(root_path, resolver, init_paths):
+    global _worker_providers
+    _worker_providers = autodetect_dialects(root_path, resolver, logging)
+    for path in init_paths:
+        for provider in _worker_providers:
+            provider.init_pass(path, None)
+
+
+def _worker_extract(task):
+    path, source = task
+    source = _load_source(path, source)
+    results = []
+    for provider in _worker_providers:
+        results += provider.extract(path, source)
+    return encode_patterns(results), _take_matcher_stats(_worker_providers)
+
+
+def _take_matcher_stats(providers):
+    """Get the non-empty matcher counters of the providers and reset them.
+
+    Returns
+    -------
+    stats : list of (int, str, MatcherStats)
+        The index of the provider, the attribute name of the matcher and its counters.
+    """
+    results = []
+    for index, provider in enumerate(providers):
+        for name, matcher in provider.matchers().items():
+            if matcher.stats != pattern.MatcherStats():
+                results.append((index, name, matcher.stats))
+                matcher.stats = pattern.MatcherStats()
+    return results
+
+
+@attr.s
+class IndexProgress:
+    """Progress of the workspace indexing.
+
+    Parameters
+    ----------
+    files_discovered : int
+        Number of source files found in the scan directories.
+
+    files_indexed : int
+        Number of files added to the index so far.
+
+    files_extracted : int
+        Number of files extracted, the others are loaded from the index cache.
+
+    bytes_read : int
+        Number of bytes read from the source files.
+
+    patterns_found : int
+        Number of patterns added to the index.
+
+    elapsed : float
+        Seconds since the indexing started.
+    """
+    files_discovered : int = attr.ib(default=0)
+    files_indexed : int = attr.ib(default=0)
+    files_extracted : int = attr.ib(default=0)
+    bytes_read : int = attr.ib(default=0)
+    patterns_found : int = attr.ib(default=0)
+    elapsed : float = attr.ib(default=0.0)
+
+    @property
+    def files_per_sec(self):
+        return self.files_indexed / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        return ("%d/%d files (%d extracted), %.1f MB read, %d patterns in %.2f secs, "
+                "%.0f files/s" % (self.files_indexed, self.files_discovered,
+                                  self.files_extracted, self.bytes_read / 1e6,
+                                  self.patterns_found, self.elapsed, self.files_per_sec))
+
 
 class Workspace:
-    """Analysis workspace"""
-    def __init__(self, logger=None):
+    """Analysis workspace
+
+    Parameters
+    ----------
+    logger : Logger object
+
+    cache_dir : Optional[str]
+        Directory to persist the extracted index across restarts,
+        the on-disk cache is disabled if None.
+
+    num_workers : Optional[int]
+        Number of worker processes used to extract files,
+        defaults to the number of CPUs, 1 disables parallel extraction.
+
+    progress_callback : Optional[Function (kind, IndexProgress) -> None]
+        Called with kind "begin" when the files are discovered, "report"
+        as the files are indexed and "end" when the indexing finishes.
+    """
+    # Minimum number of files to extract before a process pool is used.
+    _parallel_min_files = 256
+    # Number of files to extract between checks of the priority paths.
+    _chunk_size = 512
+    # Minimum seconds between two snapshots published during indexing.
+    _publish_interval = 1.0
+
+    def __init__(self, logger=None, cache_dir=None, num_workers=None, progress_callback=None):
         # logger
         self.logger = logging if logger is None else logger
         # states
         self.pyimport_resolver = PyImportResolver()
-        self.key2defs = {}
-        self.key2refs = {}
-        self.modpath2exports = {}
+        self._paths = StringTable()
+        self.key2defs = PatternTable(pattern.Def, self._paths)
+        self.key2refs = PatternTable(pattern.Ref, self._paths)
+        self.py_names = NameTable(self._paths)
+        self.modpath2exports = PersistentMap()
+        self._export_trie = ExportTrie()
+        self._path2keys = {}
+        self._providers = []
         self._need_reload = False
+        self._snapshot = IndexSnapshot(
+            self.key2defs.copy(), self.key2refs.copy(), PersistentMap(), self._export_trie,
+            self.py_names.copy(), PyImportResolver())
+        # writers hold the lock, readers use the published snapshot
+        self._write_lock = threading.RLock()
+        self._ready = threading.Event()
+        self._priority = []
+        self._priority_lock = threading.Lock()
+        self._index_thread = None
         # information
         self._root_path = None
+        self._cache_dir = cache_dir
+        self._cache = None
+        self._num_workers = num_workers
+        self._progress_callback = progress_callback
+        self._progress = None
+        self._progress_start = None
+        self._init_paths = {}
+        self._visited = set()
+        self._scan_dirs = []
+
+    @property
+    def snapshot(self):
+        """The latest published immutable view of the index."""
+        return self._snapshot
+
+    @property
+    def ready(self):
+        """Whether the initial indexing has finished."""
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        """Wait for the initial indexing to finish, return whether it is ready."""
+        return self._ready.wait(timeout)
+
+    def initialize(self, root_path, background=False):
+        """Initialize the workspace and index the files under root_path.
+
+        Parameters
+        ----------
+        root_path : str
+            The root path of the project.
 
-    def initialize(self, root_path):
+        background : bool
+            Whether to index in a background thread, queries are answered
+            from the snapshot of the files indexed so far.
+        """
         # By default only update root/src, root/python, root/include
         # can add configs later
+        # imported on demand to keep the server startup fast
+        from .cache import IndexCache
         self.logger.info("root_path: %s", root_path)
         self._providers = autodetect_dialects(root_path, self.pyimport_resolver, self.logger)
         self._root_path = root_path
-        self._reload()
+        self._cache = IndexCache(
+            self._cache_dir, root_path,
+            tuple(provider.dialect_name for provider in self._providers),
+            self.logger)
+        self._ready.clear()
+        if background:
+            self._index_thread = threading.Thread(
+                target=self._reload, name="ffi-navigator-index", daemon=True)
+            self._index_thread.start()
+        else:
+            self._reload()
+
+    def prioritize(self, path):
+        """Index the files in the directory of path first during the initial indexing."""
+        if not self.ready:
+            with self._priority_lock:
+                self._priority.append(os.path.abspath(path))
+
+    def _report_progress(self, kind):
+        progress = self._progress
+        progress.elapsed = time.time() - self._progress_start
+        if self._progress_callback is not None:
+            self._progress_callback(kind, attr.evolve(progress))
 
     def _reload(self):
         """Reload workspace."""
-        self.key2defs = {}
-        self.key2refs = {}
-        self.modpath2exports = {}
-        scan_dirs = [
-            os.path.join(self._root_path, "src"),
-            os.path.join(self._root_path, "include"),
-            os.path.join(self._root_path, "python")
-        ]
-        for provider in self._providers:
-            scan_dirs += provider.get_additional_scan_dirs(self._root_path)
-        for dirname in scan_dirs:
-            self.update_dir(dirname)
-        self._need_reload = False
+        self._progress = IndexProgress()
+        self._progress_start = time.time()
+        try:
+            with self._write_lock:
+                self._paths = StringTable()
+                self.key2defs = PatternTable(pattern.Def, self._paths)
+                self.key2refs = PatternTable(pattern.Ref, self._paths)
+                self.py_names = NameTable(self._paths)
+                self.modpath2exports = PersistentMap()
+                self._export_trie = ExportTrie()
+                self._path2keys = {}
+                self._init_paths = {}
+                self._visited = set()
+                scan_dirs = [
+                    os.path.join(self._root_path, "src"),
+                    os.path.join(self._root_path, "include"),
+                    os.path.join(self._root_path, "python")
+                ]
+                for provider in self._providers:
+                    scan_dirs += provider.get_additional_scan_dirs(self._root_path)
+                self._scan_dirs = [os.path.abspath(x) for x in scan_dirs]
+                self._cache.load()
+            files = []
+            for dirname in scan_dirs:
+                scanned = scan_dir(dirname, _SOURCE_EXTS, self._visited)
+                files += [item for ext in _SOURCE_EXTS for item in scanned[ext]]
+            self._progress.files_discovered = len(files)
+            self._report_progress("begin")
+            self._index_files(files)
+            self._cache.save()
+            self._need_reload = False
+        finally:
+            self._ready.set()
+            self._report_progress("end")
+            progress, self._progress = self._progress, None
+        self.logger.info("Workspace: indexed %s", progress.summary())
 
     def _sync_states(self):
         """Synchronize the workspace states."""
@@ -58,102 +272,476 @@ class Workspace:
 
     def init_pass(self, path, source):
         """Initialization pass"""
-        mod_path = path[:-3] if path.endswith(".py") else path
-        self.pyimport_resolver.update_doc(path, source)
+        self._init_pass(path, source, pattern.find_py_imports(source))
+
+    def _init_pass(self, path, source, py_imports):
+        self._init_paths[path] = None
+        self.pyimport_resolver.update_imports(path, py_imports)
         for provider in self._providers:
             provider.init_pass(path, source)
 
     def update_dir(self, dirname):
         self.logger.info("Workspace.update_dir %s start", dirname)
+        scanned = scan_dir(dirname, _SOURCE_EXTS, self._visited)
+        self._index_files([item for ext in _SOURCE_EXTS for item in scanned[ext]])
+        self.logger.info("Workspace.update_dir %s finish", dirname)
+
+    def _index_files(self, files):
+        """Index a list of (path, stat) and publish the results.
+
+        The python files are first passed to the init pass, then all
+        the files are extracted in chunks, files near the paths
+        passed to prioritize are moved to the front between chunks.
+        """
+        # progress of the reload, or of this call
+        progress = self._progress if self._progress is not None else IndexProgress()
         # intialize pass
-        for path in sorted(glob.glob(join_path(dirname, "**/*.py"), recursive=True)):
-            self.init_pass(path, open(path, encoding="utf-8").readlines())
+        py_sources = {}
+        # a deleted python file changes the import relations as well
+        py_changed = any(path.endswith(".py")
+                         for path in self._cache.removed(path for path, _ in files))
+        for path, stat in files:
+            if not path.endswith(".py"):
+                continue
+            entry, data = self._cache.lookup(path, stat)
+            progress.bytes_read += len(data) if data is not None else 0
+            if entry.patterns is None:
+                py_changed = True
+                source = pattern.SourceBuffer(decode_text(data))
+                imports = pattern.find_py_imports(source)
+            else:
+                source = pattern.SourceBuffer(decode_text(data)) if data is not None else None
+                imports = entry.imports
+            py_sources[path] = (entry, source, imports)
+            with self._write_lock:
+                self._init_pass(path, source, imports)
+        self._publish()
+
         # normal scans
-        for path in sorted(glob.glob(join_path(dirname, "**/*.py"), recursive=True)):
-            self.update_doc(path, open(path, encoding="utf-8").readlines())
-        for path in sorted(glob.glob(join_path(dirname, "**/*.h"), recursive=True)):
-            self.update_doc(path, open(path, encoding="utf-8").readlines())
-        for path in sorted(glob.glob(join_path(dirname, "**/*.cc"), recursive=True)):
-            self.update_doc(path, open(path, encoding="utf-8").readlines())
-        for path in sorted(glob.glob(join_path(dirname, "**/*.cpp"), recursive=True)):
-            self.update_doc(path, open(path, encoding="utf-8").readlines())
-        self.logger.info("Workspace.update_dir %s finish", dirname)
+        pending = [path for path, _ in files]
+        stats = dict(files)
+        last_publish = time.time()
+        with self._extractor() as extract:
+            while pending:
+                pending, has_priority = self._reorder_pending(pending)
+                chunk, pending = pending[:self._chunk_size], pending[self._chunk_size:]
+                entries, tasks = [], []
+                for path in chunk:
+                    if path in py_sources:
+                        entry, source, imports = py_sources.pop(path)
+                        # python patterns depend on the import relations among the files,
+                        # so they are only reused when no python file changed.
+                        if py_changed:
+                            tasks.append((path, entry, imports, source))
+                    else:
+                        entry, data = self._cache.lookup(path, stats[path])
+                        progress.bytes_read += len(data) if data is not None else 0
+                        if entry.patterns is None:
+                            tasks.append((path, entry, None, data))
+                    entries.append((path, entry))
+                results = extract([(path, source) for path, _, _, source in tasks])
+                for (path, entry, imports, _), patterns in zip(tasks, results):
+                    self._cache.store(entry, imports, patterns)
+                with self._write_lock:
+                    for path, entry in entries:
+                        self._remove_patterns(path)
+                        self._add_patterns(path, entry.patterns)
+                        progress.patterns_found += len(entry.patterns)
+                progress.files_indexed += len(entries)
+                progress.files_extracted += len(tasks)
+                if progress is self._progress:
+                    self._report_progress("report")
+                if has_priority or not pending or time.time() - last_publish > self._publish_interval:
+                    self._publish()
+                    last_publish = time.time()
 
-    def update_doc(self, path, source):
+    def _reorder_pending(self, pending):
+        """Move the pending files near the priority paths to the front."""
+        with self._priority_lock:
+            priority, self._priority = self._priority, []
+        if not priority:
+            return pending, False
+        prefixes = tuple(os.path.join(os.path.dirname(x), "") for x in priority)
+        first = [x for x in pending if x.startswith(prefixes)]
+        if not first:
+            return pending, False
+        self.logger.info("Workspace: prioritize %d files near %s", len(first), priority)
+        return first + [x for x in pending if not x.startswith(prefixes)], True
+
+    def _publish(self):
+        """Publish a snapshot of the current index to the readers.
+
+        The tables share their unchanged parts with the previous snapshot,
+        so publishing is O(1) and a later change only copies the parts it touches.
+        """
+        with self._write_lock:
+            self._snapshot = IndexSnapshot(
+                self.key2defs.copy(), self.key2refs.copy(),
+                self.modpath2exports.copy(), self._export_trie,
+                self.py_names.copy(), self.pyimport_resolver.copy(),
+                self._snapshot.generation + 1)
+
+    @contextlib.contextmanager
+    def _extractor(self):
+        """Create a function that extracts patterns from a list of (path, source) in order.
+
+        The extraction runs in a process pool when there are enough files,
+        the pool is created on the first use and kept for later calls.
+        The pool needs python 3.7 to initialize the workers, older versions
+        extract in this process.
+        """
+        pool = None
+        num_workers = self._num_workers if self._num_workers else os.cpu_count()
+
+        def _extract_files(tasks):
+            nonlocal pool
+            if (num_workers is None or num_workers <= 1 or not tasks or
+                    len(tasks) < self._parallel_min_files or sys.version_info < (3, 7)):
+                return [self._extract(path, _load_source(path, source)) for path, source in tasks]
+            if pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                self.logger.info("Workspace: extract files using %d workers", num_workers)
+                # spawn instead of fork, the server is multi-threaded
+                pool = ProcessPoolExecutor(
+                    max_workers=num_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_worker_init,
+                    initargs=(self._root_path, self.pyimport_resolver, list(self._init_paths)))
+            chunksize = max(1, len(tasks) // (num_workers * 4))
+            results = []
+            for rows, worker_stats in pool.map(_worker_extract, tasks, chunksize=chunksize):
+                # the matchers ran in the workers, merge their counters
+                for index, name, stats in worker_stats:
+                    self._providers[index].matchers()[name].stats.merge(stats)
+                results.append(rows)
+            return results
+        try:
+            yield _extract_files
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def _extract_files(self, tasks):
+        """Extract patterns from a list of (path, source) in order."""
+        with self._extractor() as extract:
+            return extract(tasks)
+
+    def _extract(self, path, source):
+        source = pattern.SourceBuffer.wrap(source)
+        results = []
         for provider in self._providers:
-            for pt in provider.extract(path, source):
-                mod_path = path[:-3] if path.endswith(".py") else path
-                if isinstance(pt, pattern.Def):
-                    _append_dict(self.key2defs, pt.key, pt)
-                elif isinstance(pt, pattern.Ref):
-                    _append_dict(self.key2refs, pt.key, pt)
-                elif isinstance(pt, pattern.Export):
-                    _append_dict(self.modpath2exports, mod_path, pt)
+            results += provider.extract(path, source)
+        return encode_patterns(results)
+
+    def _add_patterns(self, path, patterns, source=None):
+        """Add the encoded patterns of a file to the index.
+
+        source is the content of the file if it differs from the file on disk,
+        the python names are found in it on the first reference search.
+        """
+        mod_path = path[:-3] if path.endswith(".py") else path
+        path_id = self._paths.intern(path)
+        def_keys, ref_keys, has_names, has_export = self._path2keys.get(
+            path, (set(), set(), False, False))
+        for pt in patterns:
+            if isinstance(pt, tuple):
+                kind, key = pt[0], pt[1]
+                if kind == KIND_DEF:
+                    self.key2defs.add(key, path_id, *pt[2:])
+                    def_keys.add(key)
                 else:
-                    self.logger.warn("Ignore pattern %s, path=%s", pt, path)
+                    self.key2refs.add(key, path_id, *pt[2:])
+                    ref_keys.add(key)
+            elif isinstance(pt, pattern.Export):
+                self.modpath2exports.mutable(mod_path, list).append(pt)
+                self._export_trie = self._export_trie.add(mod_path, pt)
+                has_export = True
+            else:
+                self.logger.warn("Ignore pattern %s, path=%s", pt, path)
+        if path.endswith(".py"):
+            # reference search looks for the local names of the imports,
+            # and for any name in the modules that export FFI functions
+            self.py_names.add_file(path_id, functools.partial(_load_source, path, source),
+                                   all_names=has_export)
+            has_names = True
+        self._path2keys[path] = (def_keys, ref_keys, has_names, has_export)
+
+    def _remove_patterns(self, path):
+        if path not in self._path2keys:
+            return
+        def_keys, ref_keys, has_names, has_export = self._path2keys.pop(path)
+        path_id = self._paths.intern(path)
+        for key in def_keys:
+            self.key2defs.remove(key, path_id)
+        for key in ref_keys:
+            self.key2refs.remove(key, path_id)
+        if has_names:
+            self.py_names.remove_file(path_id)
+        if has_export:
+            mod_path = path[:-3] if path.endswith(".py") else path
+            for item in self.modpath2exports.pop(mod_path, []):
+                self._export_trie = self._export_trie.remove(mod_path, item)
+
+    def update_doc(self, path, source):
+        """Update the patterns of a document, replacing its previous patterns."""
+        with self._write_lock:
+            self._remove_patterns(path)
+            self._add_patterns(path, self._extract(path, source), source)
+            self._publish()
         self.logger.debug("Workspace.update_doc %s", path)
 
+    def remove_doc(self, path):
+        """Remove a document and all its patterns from the workspace."""
+        with self._write_lock:
+            self._remove_doc(path)
+            self._publish()
+        self.logger.debug("Workspace.remove_doc %s", path)
+
+    def _remove_doc(self, path):
+        self._remove_patterns(path)
+        if path.endswith(".py"):
+            self.pyimport_resolver.remove_doc(path)
+            self._init_paths.pop(path, None)
+
+    def in_scope(self, path):
+        """Whether the path is a source file covered by the workspace."""
+        if not path.endswith(_SOURCE_EXTS):
+            return False
+        path = os.path.abspath(path)
+        return any(path.startswith(os.path.join(x, "")) for x in self._scan_dirs)
+
+    def reindex_doc(self, path, source=None):
+        """Re-extract a single document after it changes.
+
+        Parameters
+        ----------
+        path : str
+            The file path.
+
+        source : Optional[list or str]
+            The new content, read from the path if None.
+
+        Returns
+        -------
+        updated : bool
+            Whether the document is in scope and has been updated.
+        """
+        if not self.in_scope(path):
+            return False
+        if source is None:
+            with open(path, encoding="utf-8") as fi:
+                source = fi.readlines()
+        with self._write_lock:
+            if path.endswith(".py"):
+                self._init_pass(path, source, pattern.find_py_imports(source))
+            self.update_doc(path, source)
+        return True
+
+    def update_files(self, changed, deleted):
+        """Re-extract a batch of changed files and remove deleted ones.
+
+        Parameters
+        ----------
+        changed : list of str
+            Paths of created or modified files or directories.
+
+        deleted : list of str
+            Paths of deleted files or directories.
+        """
+        with self._write_lock:
+            self._update_files(changed, deleted)
+            self._publish()
+
+    def _update_files(self, changed, deleted):
+        indexed = set(self._path2keys.keys()) if deleted else set()
+        for path in deleted:
+            path = os.path.abspath(path)
+            if path in indexed:
+                self._remove_doc(path)
+                continue
+            # a deleted directory
+            prefix = os.path.join(path, "")
+            for item in [x for x in indexed if x.startswith(prefix)]:
+                self._remove_doc(item)
+
+        files = []
+        for path in changed:
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                scanned = scan_dir(path, _SOURCE_EXTS)
+                files += [x for ext in _SOURCE_EXTS for x, _ in scanned[ext] if self.in_scope(x)]
+            elif self.in_scope(path) and os.path.isfile(path):
+                files.append(path)
+        files = sorted(set(files))
+        if not files:
+            return
+        self.logger.info("Workspace.update_files %d changed, %d deleted", len(files), len(deleted))
+        tasks = []
+        for path in files:
+            with open(path, encoding="utf-8") as fi:
+                source = fi.readlines()
+            if path.endswith(".py"):
+                self._init_pass(path, source, pattern.find_py_imports(source))
+            tasks.append((path, source))
+        results = self._extract_files(tasks)
+        for path, patterns in zip(files, results):
+            self._remove_patterns(path)
+            self._add_patterns(path, patterns)
+
     def find_defs(self, mod_path, sym_name):
         """Get definition given python mod path and symbol name"""
         self._sync_states()
-        mod_path, var_name = self.pyimport_resolver.resolve(mod_path, sym_name)
+        snapshot = self._snapshot
+        mod_path, var_name = snapshot.pyimport_resolver.resolve(mod_path, sym_name)
         if var_name is None:
             return []
 
-        export_list = self.modpath2exports.get(mod_path, [])
+        export_list = snapshot.modpath2exports.get(mod_path, [])
 
         for item in export_list:
             key = item.fvar2key(var_name)
-            if key in self.key2defs:
-                return self.key2defs[key]
+            if key in snapshot.key2defs:
+                return snapshot.key2defs[key]
         return []
 
-    def _py_find_refs(self, key):
+    def _py_find_refs(self, key, snapshot, ctx):
+        """Find the python references of key, yield the references of each file."""
         # Step 1: find python ffi module that import the related function
         var_targets = set()
         mod_targets = {}
 
-        for mod_path, exports in self.modpath2exports.items():
-            for item in exports:
-                if key.startswith(item.key_prefix):
-                    var_name = item.fkey2var(key)
-                    var_targets.add((mod_path, var_name))
-                    mod_targets[mod_path] = var_name
+        for mod_path, item in snapshot.export_trie.match(key):
+            var_name = item.fkey2var(key)
+            var_targets.add((mod_path, var_name))
+            mod_targets[mod_path] = var_name
 
         # Step2: find modules that imports the ffi modules
         #        construct search terms
         search_map = {}
-        for mod_path, var_list in self.pyimport_resolver._modpath2imports.items():
-            search_term = []
-            for var_name in var_list:
-                new_path, new_var = self.pyimport_resolver.resolve(mod_path, var_name)
-                if (new_path, new_var) in var_targets:
-                    search_term.append(var_name)
-                if new_var is None and new_path in mod_targets:
-                    search_term.append(var_name + "." + mod_targets[new_path])
-            if search_term:
-                search_map[mod_path] = search_term
+        resolver = snapshot.pyimport_resolver
+        for mod_path, var_name in sorted(var_targets):
+            if not ctx.checkpoint():
+                break
+            for importer, aliases in resolver.find_importers(mod_path, var_name).items():
+                search_map.setdefault(importer, []).extend(aliases)
+        for mod_path, var_name in sorted(mod_targets.items()):
+            if not ctx.checkpoint():
+                break
+            for importer, aliases in resolver.find_importers(mod_path).items():
+                search_map.setdefault(importer, []).extend(
+                    alias + "." + var_name for alias in aliases)
 
         for mod_path, var_name in mod_targets.items():
             search_map[mod_path] = [var_name]
 
-        # Step 3: search the related files
-        results = []
+        # Step 3: look up the terms in the name index of the related files
         for mod_path, terms in search_map.items():
+            if not ctx.checkpoint():
+                break
             path = mod_path if mod_path.endswith(".py") else mod_path + ".py"
-            if os.path.isfile(path):
-                res = pattern.search_symbol(open(path, encoding="utf-8").read(), terms)
-                for x in res:
-                    results.append(pattern.Ref(key=key, path=path, range=x))
-        return results
+            results = [pattern.Ref(key=key, path=path, range=x)
+                       for x in snapshot.py_names.search(path, terms)]
+            if results:
+                yield results
+
+    def find_refs(self, key, ctx=None):
+        """Find the references of a key.
 
-    def find_refs(self, key):
+        Parameters
+        ----------
+        key : str
+            The key of the FFI function or object.
+
+        ctx : Optional[QueryContext]
+            The cancellation and time budget of the query, ctx.partial is
+            set if the results are cut short by the time budget.
+
+        Returns
+        -------
+        results : list of Ref
+            The references found.
+        """
+        indexed, found = [], []
+        for from_index, group in self.iter_refs(key, ctx):
+            (indexed if from_index else found).extend(group)
+        return found + indexed
+
+    def iter_refs(self, key, ctx=None):
+        """Iterate over the references of a key as they are found.
+
+        The references recorded in the index, e.g. the C++ hits, are
+        yielded first, followed by the python references found
+        through the imports of the exported FFI modules.
+
+        Parameters
+        ----------
+        key : str
+            The key of the FFI function or object.
+
+        ctx : Optional[QueryContext]
+            The cancellation and time budget of the query.
+
+        Returns
+        -------
+        batches : iterator of (bool, list of Ref)
+            Whether the batch is recorded in the index,
+            and the references of one file.
+        """
+        ctx = ctx if ctx is not None else QueryContext()
         self._sync_states()
-        res = self._py_find_refs(key)
-        res += self.key2refs.get(key, [])
-        return res
+        snapshot = self._snapshot
+        for group in snapshot.key2refs.iter_groups(key):
+            if not ctx.checkpoint():
+                return
+            yield True, group
+        for group in self._py_find_refs(key, snapshot, ctx):
+            yield False, group
+
+    def stats(self):
+        """Get the statistics of the index and the matchers.
+
+        The index counts and memory are taken from the latest snapshot,
+        the memory is approximated by the sizes of the containers.
+
+        Returns
+        -------
+        stats : dict
+            JSON serializable statistics, the matcher counters are
+            grouped by dialect and the attribute name of the matcher.
+        """
+        snapshot = self._snapshot
+        resolver = snapshot.pyimport_resolver
+        return {
+            "generation": snapshot.generation,
+            "files": len(self._path2keys),
+            "dialects": [provider.dialect_name for provider in self._providers],
+            "counts": {
+                "def_keys": len(snapshot.key2defs),
+                "defs": snapshot.key2defs.num_items(),
+                "ref_keys": len(snapshot.key2refs),
+                "refs": snapshot.key2refs.num_items(),
+                "exports": sum(len(x) for x in snapshot.modpath2exports.values()),
+                "py_names": snapshot.py_names.num_items(),
+                "modules": resolver.num_modules(),
+            },
+            "memory": {
+                "paths": self._paths.memory_size(),
+                "key2defs": snapshot.key2defs.memory_size(),
+                "key2refs": snapshot.key2refs.memory_size(),
+                "exports": approx_size((snapshot.modpath2exports, snapshot.export_trie)),
+                "py_names": snapshot.py_names.memory_size(),
+                "resolver": resolver.memory_size(),
+            },
+            "matchers": {
+                provider.dialect_name: {name: attr.asdict(stats) for name, stats
+                                        in provider.matcher_stats().items()}
+                for provider in self._providers
+            },
+        }
 
     def extract_symbol(self, path, source, pos):
+        source = pattern.SourceBuffer.wrap(source)
         for pt in self._providers:
             res = pt.extract_symbol(path, source, pos)
             if res:
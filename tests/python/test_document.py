@@ -0,0 +1,40 @@
+import os
+from ffi_navigator.document import DocumentStore
+
+
+def test_document_store(tmp_path):
+    path = os.path.join(str(tmp_path), "a.py")
+    with open(path, "w") as fo:
+        fo.write("x = 1\ny = 2\n")
+    store = DocumentStore()
+    doc = store.get(path)
+    assert doc.version is None and doc.source.text == "x = 1\ny = 2\n"
+    # unchanged files are not read again
+    assert store.get(path) is doc
+
+    store.open(path, "x = 1\r\ny = 2\r\n", 1)
+    rg = lambda l0, c0, l1, c1: {"start": {"line": l0, "character": c0},
+                                 "end": {"line": l1, "character": c1}}
+    doc = store.change(path, [{"range": rg(0, 4, 0, 5), "text": "10"},
+                              {"range": rg(1, 0, 1, 0), "text": "z = 3\n"},
+                              {"range": rg(2, 4, 3, 0), "text": "0"}], 2)
+    assert doc.version == 2
+    assert store.get(path).source.text == "x = 10\nz = 3\ny = 0"
+    assert list(store.get(path).source)[1] == "z = 3\n"
+    # stale changes are ignored
+    store.change(path, [{"text": "old"}], 1)
+    assert store.get(path) is doc
+    store.change(path, [{"text": "new\n"}], 3)
+    assert store.get(path).source.lines == ["new\n"]
+
+    store.close(path)
+    assert store.get(path).source.text == "x = 1\ny = 2\n"
+    with open(path, "w") as fo:
+        fo.write("y = 3\n")
+    assert store.get(path).source.text == "y = 3\n"
+
+
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        test_document_store(tmp_dir)
@@ -1,4 +1,6 @@
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from ffi_navigator.import_resolver import PyImportResolver
 
 
@@ -44,5 +46,82 @@ def test_import_resolver():
     assert resolver.resolve(os.path.abspath("/tvm/relay/backend/_backend"), "_init_api") == (
         os.path.abspath("/tvm/_ffi/function"), "_init_api")
 
+
+def test_find_importers():
+    resolver = PyImportResolver()
+    resolver.update_doc("/tvm/relay/_expr.py", "")
+    resolver.update_doc("/tvm/relay/expr.py", """
+    from . import _expr
+    from ._expr import add
+    """)
+    resolver.update_doc("/tvm/relay/__init__.py", """
+    from .expr import add as relay_add
+    """)
+    resolver.update_doc("/tvm/op.py", """
+    from .relay import relay_add
+    """)
+    path = lambda x: os.path.abspath(x)
+
+    assert resolver.find_importers(path("/tvm/relay/_expr"), "add") == {
+        path("/tvm/op"): ["relay_add"],
+        path("/tvm/relay/__init__"): ["relay_add"],
+        path("/tvm/relay/expr"): ["add"]}
+    assert resolver.find_importers(path("/tvm/relay/_expr")) == {
+        path("/tvm/relay/expr"): ["_expr"]}
+
+    resolver.update_doc("/tvm/relay/expr.py", "from . import _expr")
+    assert resolver.find_importers(path("/tvm/relay/_expr"), "add") == {}
+    resolver.remove_doc("/tvm/relay/expr.py")
+    assert resolver.find_importers(path("/tvm/relay/_expr")) == {}
+
+
+def test_resolve_memo():
+    resolver = PyImportResolver()
+    resolver.update_doc("/tvm/stmt.py", "from .pkg import make as _make")
+    resolver.update_doc("/tvm/expr.py", "from .stmt import _make")
+    path = lambda x: os.path.abspath(x)
+
+    assert resolver.resolve(path("/tvm/expr"), "_make.Add") == (path("/tvm/expr"), "_make.Add")
+    assert (path("/tvm/expr"), "_make.Add") in resolver._memo
+    # a new module changes how the combined path resolves
+    resolver.update_doc("/tvm/pkg/make.py", "")
+    assert resolver.resolve(path("/tvm/expr"), "_make.Add") == (path("/tvm/pkg/make"), "Add")
+    # changes of the imports in the chain
+    resolver.update_doc("/tvm/pkg/make.py", "from .op import Add")
+    assert resolver.resolve(path("/tvm/expr"), "_make.Add") == (path("/tvm/pkg/op"), "Add")
+    resolver.remove_doc("/tvm/stmt.py")
+    assert resolver.resolve(path("/tvm/expr"), "_make.Add") == (path("/tvm/expr"), "_make.Add")
+
+
+def test_concurrent_resolve():
+    resolver = PyImportResolver()
+    for i in range(20):
+        resolver.update_doc("/tvm/m%d.py" % i, "from .m%d import x" % (i + 1))
+    keys = [(os.path.abspath("/tvm/m%d" % i), "x") for i in range(20)] * 50
+    expected = [resolver.resolve(*key) for key in keys]
+
+    def _update(i):
+        resolver.update_doc("/tvm/m19.py", "from .m20 import %s" % ("x" if i % 2 else "y"))
+
+    interval = sys.getswitchinterval()
+    # switch threads often to expose the races
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            resolver.add_package("tvm", os.path.abspath("/tvm"))
+            assert list(pool.map(lambda key: resolver.resolve(*key), keys)) == expected
+            # the memo stays consistent with concurrent updates
+            for _ in pool.map(lambda i: _update(i) if i % 10 == 0 else resolver.resolve(*keys[i]),
+                              range(len(keys))):
+                pass
+    finally:
+        sys.setswitchinterval(interval)
+    for key, value in resolver._memo.items():
+        assert resolver._resolve(*key, set()) == value
+
+
 if __name__ == "__main__":
     test_import_resolver()
+    test_find_importers()
+    test_resolve_memo()
+    test_concurrent_resolve()
@@ -0,0 +1,133 @@
+import pickle
+from ffi_navigator import pattern
+from ffi_navigator.index import (PatternTable, StringTable, NameTable, ExportTrie,
+                                 PersistentMap, encode_patterns, KIND_DEF)
+from ffi_navigator.lsp import Range, Position
+
+
+def test_pattern_table():
+    paths = StringTable()
+    table = PatternTable(pattern.Ref, paths)
+    a, b = paths.intern("/a.py"), paths.intern("/b.py")
+    assert paths.intern("/a.py") == a
+    table.add("x", a, 1, 2, 1, 5)
+    table.add("x", b, 3, 0, 3, 1)
+    table.add("x", a, 7, 2, 8, 5)
+    table.add("y", b, 4, 0, 4, 1)
+
+    items = table["x"]
+    assert len(items) == 3
+    assert items[0] == pattern.Ref(key="x", path="/a.py",
+                                   range=Range(Position(1, 2), Position(1, 5)))
+    assert items[1].range.end == Position(8, 5)
+    assert items[2].path == "/b.py"
+    assert table.num_items() == 4
+
+    snapshot = table.copy()
+    table.remove("x", a)
+    table.remove("y", b)
+    assert [x.path for x in table["x"]] == ["/b.py"]
+    assert "y" not in table
+    assert len(snapshot["x"]) == 3 and "y" in snapshot
+
+
+def test_persistent_map():
+    pmap = PersistentMap()
+    for i in range(1000):
+        pmap["k%d" % i] = i
+    pmap.mutable("set", set).add(1)
+    assert len(pmap) == 1001 and pmap["k7"] == 7 and "k1000" not in pmap
+
+    snapshot = pmap.copy()
+    version = snapshot.version()
+    for i in range(0, 1000, 2):
+        del pmap["k%d" % i]
+    pmap["k1"] = -1
+    pmap.mutable("set", set).add(2)
+    assert len(pmap) == 501 and pmap["k1"] == -1 and "k0" not in pmap
+    assert sorted(pmap) == sorted(["k%d" % i for i in range(1, 1000, 2)] + ["set"])
+    assert pmap["set"] == {1, 2}
+    # the copy is not affected
+    assert len(snapshot) == 1001 and snapshot["k0"] == 0 and snapshot["k1"] == 1
+    assert snapshot["set"] == {1} and snapshot.version() is version
+    assert dict(snapshot.items()) == dict({"k%d" % i: i for i in range(1000)}, set={1})
+
+    # rebuilt from the items, the hashes differ between processes
+    loaded = pickle.loads(pickle.dumps(snapshot))
+    assert dict(loaded.items()) == dict(snapshot.items()) and loaded["k999"] == 999
+
+    for key in list(pmap):
+        pmap.pop(key)
+    assert len(pmap) == 0 and list(pmap.items()) == []
+
+
+def test_encode_patterns():
+    rg = Range(Position(1, 2), Position(3, 4))
+    export = pattern.prefix_export("_", "/a.py", "")
+    rows = encode_patterns([pattern.Def(key="k", path="/a.py", range=rg), export])
+    assert rows[0] == (KIND_DEF, "k", 1, 2, 3, 4)
+    assert rows[1] is export
+
+
+def test_export_trie():
+    relay = pattern.prefix_export("relay.op", "/relay/op.py", "relay.op.")
+    relay_nn = pattern.prefix_export("relay.op.nn", "/relay/nn.py", "relay.op.nn.")
+    internal = pattern.prefix_export("_", "/_api_internal.py", "")
+    trie = ExportTrie()
+    trie = trie.add("/relay/op", relay)
+    trie = trie.add("/relay/nn", relay_nn)
+    trie = trie.add("/_api_internal", internal)
+
+    assert trie.match("relay.op.nn.conv2d") == [("/relay/op", relay), ("/relay/nn", relay_nn)]
+    assert trie.match("relay.op.add") == [("/relay/op", relay)]
+    assert trie.match("_min_value") == [("/_api_internal", internal)]
+    assert trie.match("relay") == []
+
+    removed = trie.remove("/relay/op", relay)
+    assert removed.match("relay.op.nn.conv2d") == [("/relay/nn", relay_nn)]
+    # the trie is persistent
+    assert len(trie.match("relay.op.nn.conv2d")) == 2
+    assert removed.remove("/relay/nn", relay_nn).match("relay.op.nn.conv2d") == []
+
+
+def test_name_table():
+    paths = StringTable()
+    table = NameTable(paths)
+    a, b = paths.intern("/a.py"), paths.intern("/b.py")
+    loaded = []
+
+    def fsource(source):
+        loaded.append(source)
+        return pattern.SourceBuffer(source)
+
+    table.add_file(a, lambda: fsource("x = _make.Let(_make.Var(tvm._make.Let))"), all_names=True)
+    table.add_file(b, lambda: fsource("from . import _make\n_make.Let(y)\n"))
+    # the names are found on the first search
+    assert loaded == [] and table.num_items() == 0
+
+    starts = lambda res: [x.start.character for x in res]
+    assert starts(table.search("/a.py", ["_make.Let"])) == [4, 28]
+    assert starts(table.search("/a.py", ["_make"])) == [4, 14, 28]
+    assert starts(table.search("/a.py", ["x"])) == [0]
+    assert table.search("/a.py", ["_make.L", "make"]) == []
+    assert table.search("/c.py", ["_make"]) == []
+    # only the names with an imported name
+    assert starts(table.search("/b.py", ["_make.Let"])) == [0]
+    assert table.search("/b.py", ["y"]) == []
+    assert len(loaded) == 2 and table.num_items() == 6
+
+    snapshot = table.copy()
+    table.add_file(a, lambda: fsource("tvm._make.Let"), all_names=True)
+    assert starts(table.search("/a.py", ["_make.Let"])) == [4]
+    table.remove_file(b)
+    assert table.search("/b.py", ["_make"]) == []
+    assert starts(snapshot.search("/b.py", ["_make"])) == [14, 0]
+    assert starts(snapshot.search("/a.py", ["_make.Let"])) == [4, 28]
+
+
+if __name__ == "__main__":
+    test_pattern_table()
+    test_persistent_map()
+    test_encode_patterns()
+    test_export_trie()
+    test_name_table()
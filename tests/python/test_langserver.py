@@ -1,8 +1,15 @@
 from ffi_navigator import langserver
 from ffi_navigator.util import join_path, normalize_path
 
+import io
 import logging
 import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from pyls_jsonrpc import endpoint
 
 curr_path = os.path.dirname(os.path.realpath(os.path.expanduser(__file__)))
 
@@ -373,6 +380,328 @@ def test_taichi_dialect():
     assert(res[0]['range']['start']['line'] == 15)
 
 
+def test_did_save(tmp_path):
+    tvm_path = os.path.join(str(tmp_path), "tvm")
+    shutil.copytree(os.path.join(curr_path, "..", "dummy_repo", "tvm"), tvm_path)
+    server = langserver.BaseServer()
+    server.m_initialize(rootUri=langserver.path2uri(tvm_path))
+    api_ir = join_path(tvm_path, "src/api/api_ir.cc")
+    stmt_py = join_path(tvm_path, "python/tvm/stmt.py")
+
+    with open(api_ir) as fi:
+        content = fi.read()
+    with open(api_ir, "w") as fo:
+        fo.write("\n" + content)
+    server.m_text_document__did_save(textDocument={"uri": langserver.path2uri(api_ir)})
+
+    # _make.LetStmt
+    res = run_find_definition(server, stmt_py, 46, 20)
+    assert(len(res) == 1)
+    assert(res[0]['range']['start']['line'] == 16)
+
+    server.m_text_document__did_change(
+        textDocument={"uri": langserver.path2uri(api_ir), "version": 2},
+        contentChanges=[{"text": content}])
+    res = run_find_definition(server, stmt_py, 46, 20)
+    assert(res[0]['range']['start']['line'] == 15)
+
+    # closing drops the unsaved change, the index follows the file again
+    server.m_text_document__did_close(textDocument={"uri": langserver.path2uri(api_ir)})
+    res = run_find_definition(server, stmt_py, 46, 20)
+    assert(res[0]['range']['start']['line'] == 16)
+    os.remove(api_ir)
+    server.m_text_document__did_close(textDocument={"uri": langserver.path2uri(api_ir)})
+    assert run_find_definition(server, stmt_py, 46, 20) == []
+
+
+def test_unsaved_document():
+    tvm_path = os.path.join(curr_path, "..", "dummy_repo", "tvm")
+    server = langserver.BaseServer()
+    server.m_initialize(rootUri=langserver.path2uri(tvm_path))
+    stmt_py = join_path(tvm_path, "python/tvm/stmt.py")
+    uri = langserver.path2uri(stmt_py)
+    with open(stmt_py) as fi:
+        content = fi.read()
+    # queries use the editor content rather than the file on disk
+    server.m_text_document__did_open(
+        textDocument={"uri": uri, "version": 1, "text": content})
+    server.m_text_document__did_change(
+        textDocument={"uri": uri, "version": 2},
+        contentChanges=[{"range": {"start": {"line": 0, "character": 0},
+                                   "end": {"line": 0, "character": 0}},
+                         "text": "\n"}])
+    # _make.LetStmt
+    res = run_find_definition(server, stmt_py, 47, 20)
+    assert(len(res) == 1)
+    assert(res[0]['range']['start']['line'] == 15)
+    server.m_text_document__did_close(textDocument={"uri": uri})
+    res = run_find_definition(server, stmt_py, 46, 20)
+    assert(res[0]['range']['start']['line'] == 15)
+
+
+def test_did_change_debounce():
+    tvm_path = os.path.join(curr_path, "..", "dummy_repo", "tvm")
+    server = langserver.BaseServer()
+    server.did_change_debounce = 0.1
+    server.m_initialize(rootUri=langserver.path2uri(tvm_path))
+    api_ir = join_path(tvm_path, "src/api/api_ir.cc")
+    uri = langserver.path2uri(api_ir)
+    with open(api_ir) as fi:
+        content = fi.read()
+    generation = server.ws.snapshot.generation
+    # keystrokes are coalesced into one reindex of the last content
+    for version in range(2, 5):
+        server.m_text_document__did_change(
+            textDocument={"uri": uri, "version": version},
+            contentChanges=[{"text": "\n" * version + content}])
+    assert server.ws.snapshot.generation == generation
+    server._changed_docs_timer.join()
+    assert server.ws.snapshot.generation == generation + 1
+    # _make.LetStmt
+    res = run_find_definition(server, join_path(tvm_path, "python/tvm/stmt.py"), 46, 20)
+    assert(res[0]['range']['start']['line'] == 19)
+
+    # a query reindexes the pending changes first
+    server.m_text_document__did_change(
+        textDocument={"uri": uri, "version": 5}, contentChanges=[{"text": content}])
+    res = run_find_definition(server, join_path(tvm_path, "python/tvm/stmt.py"), 46, 20)
+    assert(res[0]['range']['start']['line'] == 15)
+    server.m_text_document__did_close(textDocument={"uri": uri})
+
+
+def test_query_cache():
+    tvm_path = os.path.join(curr_path, "..", "dummy_repo", "tvm")
+    server = langserver.BaseServer()
+    server.m_initialize(rootUri=langserver.path2uri(tvm_path))
+    stmt_py = join_path(tvm_path, "python/tvm/stmt.py")
+    # _make.LetStmt
+    defs = run_find_definition(server, stmt_py, 46, 20)
+    refs = run_find_references(server, stmt_py, 46, 20)
+    assert server.query_cache.hits == 0
+    assert run_find_definition(server, stmt_py, 46, 20) == defs
+    assert run_find_references(server, stmt_py, 46, 20) == refs
+    assert server.query_cache.hits == 2
+
+    # REGISTER_MAKE(Provide)
+    api_ir = join_path(tvm_path, "src/api/api_ir.cc")
+    provide_refs = run_find_references(server, api_ir, 16, 16)
+    assert provide_refs and server.query_cache.hits == 2
+
+    # results of the changed keys are not used
+    with open(api_ir) as fi:
+        content = fi.read()
+    server.m_text_document__did_change(
+        textDocument={"uri": langserver.path2uri(api_ir), "version": 2},
+        contentChanges=[{"text": content.replace("REGISTER_MAKE(LetStmt);", "")}])
+    assert run_find_definition(server, stmt_py, 46, 20) == []
+    assert len(run_find_references(server, stmt_py, 46, 20)) == 0
+    assert server.query_cache.hits == 2
+    # the others stay cached
+    assert run_find_references(server, api_ir, 16, 16) == provide_refs
+    assert server.query_cache.hits == 3
+
+
+def test_stats_request():
+    tvm_path = os.path.join(curr_path, "..", "dummy_repo", "tvm")
+    server = langserver.BaseServer()
+    server["initialize"]({"rootUri": langserver.path2uri(tvm_path)})
+    stmt_py = join_path(tvm_path, "python/tvm/stmt.py")
+    params = {"textDocument": {"uri": langserver.path2uri(stmt_py)},
+              "position": {"line": 46, "character": 20}}
+    for _ in range(3):
+        server["textDocument/references"](params)
+    res = server["ffiNavigator/stats"](None)
+    assert res["counts"]["defs"] > 0
+    assert res["query_cache"]["hits"] == 2
+    latency = res["latency"]["textDocument/references"]
+    assert latency["count"] == 3
+    assert 0 <= latency["p50"] <= latency["p99"] <= latency["max"]
+    assert "initialize" in res["latency"]
+
+
+def test_stream_references():
+    tvm_path = os.path.join(curr_path, "..", "dummy_repo", "tvm")
+    server = langserver.BaseServer()
+    server.m_initialize(rootUri=langserver.path2uri(tvm_path))
+    outputs = []
+    server.endpoint = endpoint.Endpoint(server, outputs.append)
+    server.partial_result_batch = 2
+    # REGISTER_MAKE(Provide)
+    api_ir = join_path(tvm_path, "src/api/api_ir.cc")
+    params = {"textDocument": {"uri": langserver.path2uri(api_ir)},
+              "position": {"line": 16, "character": 16}}
+    for cached in [False, True]:
+        outputs.clear()
+        res = server.m_text_document__references(
+            partialResultToken="partial", workDoneToken="progress", **params)
+        assert res == []
+        values = [x["params"]["value"] for x in outputs if x["method"] == "$/progress"]
+        partial = [x["params"]["value"] for x in outputs
+                   if x["method"] == "$/progress" and x["params"]["token"] == "partial"]
+        assert values[0]["kind"] == "begin" and values[-1]["kind"] == "end"
+        # cached results are sent at once
+        assert len(partial) == 1 if cached else len(partial) > 1
+        expected = server.m_text_document__references(**params)
+        assert len(expected) == 6
+        assert sorted(map(str, sum(partial, []))) == sorted(map(str, expected))
+
+
+def test_index_progress():
+    tvm_path = os.path.join(curr_path, "..", "dummy_repo", "tvm")
+    server = langserver.BaseServer(background_index=True)
+    outputs = []
+    server.endpoint = endpoint.Endpoint(server, outputs.append)
+    # hold the indexing until the client accepts the progress token
+    with server.ws._write_lock:
+        server.m_initialize(rootUri=langserver.path2uri(tvm_path),
+                            capabilities={"window": {"workDoneProgress": True}})
+        server.m_initialized()
+        create = outputs.pop()
+        assert create["method"] == "window/workDoneProgress/create"
+        server.endpoint.consume({"jsonrpc": "2.0", "id": create["id"], "result": None})
+    for _ in range(1000):
+        if outputs and outputs[-1]["params"]["value"]["kind"] == "end":
+            break
+        time.sleep(0.01)
+    values = [x["params"]["value"] for x in outputs]
+    assert values[0]["kind"] == "begin"
+    assert values[1]["kind"] == "report" and values[-2]["percentage"] == 100
+    assert values[-1]["kind"] == "end"
+
+
+def test_did_change_watched_files(tmp_path):
+    tvm_path = os.path.join(str(tmp_path), "tvm")
+    shutil.copytree(os.path.join(curr_path, "..", "dummy_repo", "tvm"), tvm_path)
+    server = langserver.BaseServer()
+    server.watched_files_debounce = 0.1
+    outputs = []
+    server.endpoint = endpoint.Endpoint(server, outputs.append)
+    server.m_initialize(rootUri=langserver.path2uri(tvm_path), capabilities={
+        "workspace": {"didChangeWatchedFiles": {"dynamicRegistration": True}}})
+    server.m_initialized()
+    watchers = outputs[-1]["params"]["registrations"][0]["registerOptions"]["watchers"]
+    # the deletion of a directory is also watched
+    assert {"globPattern": "**/*", "kind": 4} in watchers
+
+    api_ir = join_path(tvm_path, "src/api/api_ir.cc")
+    new_cc = join_path(tvm_path, "src/api/api_new.cc")
+    ir_pass = join_path(tvm_path, "python/tvm/ir_pass.py")
+
+    with open(api_ir) as fi:
+        content = fi.read()
+    with open(api_ir, "w") as fo:
+        fo.write(content.replace("REGISTER_MAKE(LetStmt)", "REGISTER_MAKE(LetStmt2)"))
+    with open(new_cc, "w") as fo:
+        fo.write('TVM_REGISTER_GLOBAL("test.watched")\n')
+    os.remove(ir_pass)
+    relay_ir = join_path(tvm_path, "src/relay/ir")
+    assert len(server.ws.key2defs["relay._make.Constant"]) == 1
+    shutil.rmtree(relay_ir)
+
+    changes = [{"uri": langserver.path2uri(api_ir), "type": 2},
+               {"uri": langserver.path2uri(new_cc), "type": 1},
+               {"uri": langserver.path2uri(api_ir), "type": 2},
+               {"uri": langserver.path2uri(ir_pass), "type": 3},
+               {"uri": langserver.path2uri(relay_ir), "type": 3}]
+    server.m_workspace__did_change_watched_files(changes=changes[:2])
+    server.m_workspace__did_change_watched_files(changes=changes[2:])
+    server._flush_timer.join()
+
+    assert "make.LetStmt" not in server.ws.key2defs
+    assert len(server.ws.key2defs["make.LetStmt2"]) == 1
+    assert len(server.ws.key2defs["test.watched"]) == 1
+    assert "relay._make.Constant" not in server.ws.key2defs
+    # _pass.Simplify
+    assert run_find_definition(server, join_path(tvm_path, "python/tvm/ir_builder.py"), 20, 48) == []
+
+
+def test_cancel_request():
+    tvm_path = os.path.join(curr_path, "..", "dummy_repo", "tvm")
+    server = langserver.BaseServer(query_workers=1)
+    outputs = []
+    server.endpoint = endpoint.Endpoint(server, outputs.append)
+    server.m_initialize(rootUri=langserver.path2uri(tvm_path))
+    params = {"textDocument": {"uri": langserver.path2uri(
+        join_path(tvm_path, "python/tvm/stmt.py"))},
+              "position": {"line": 46, "character": 20}}
+
+    # keep the worker busy so that the first request is cancelled while queued
+    release = threading.Event()
+    server._query_executor.submit(release.wait)
+    for msg_id in [1, 2]:
+        server.consume({"jsonrpc": "2.0", "id": msg_id,
+                        "method": "textDocument/references", "params": params})
+    server.consume({"jsonrpc": "2.0", "method": "$/cancelRequest", "params": {"id": 1}})
+    release.set()
+    for _ in range(500):
+        if len(outputs) == 2:
+            break
+        time.sleep(0.01)
+    results = {x["id"]: x for x in outputs}
+    assert results[1]["error"]["code"] == -32800
+    server._query_executor = None
+    assert results[2]["result"] == server.m_text_document__references(**params)
+
+
+def test_concurrent_queries():
+    tvm_path = os.path.join(curr_path, "..", "dummy_repo", "tvm")
+    server = langserver.BaseServer(query_workers=4)
+    outputs = []
+    server.endpoint = endpoint.Endpoint(server, outputs.append)
+    server.m_initialize(rootUri=langserver.path2uri(tvm_path))
+    queries = [("python/tvm/stmt.py", 46, 20), ("src/api/api_ir.cc", 15, 10),
+               ("python/tvm/relay/expr.py", 24, 52)]
+    requests = []
+    for path, line, character in queries * 4:
+        params = {"textDocument": {"uri": langserver.path2uri(join_path(tvm_path, path))},
+                  "position": {"line": line, "character": character}}
+        for method in ["textDocument/definition", "textDocument/references"]:
+            requests.append((method, params))
+    for msg_id, (method, params) in enumerate(requests):
+        server.consume({"jsonrpc": "2.0", "id": msg_id, "method": method, "params": params})
+    for _ in range(1000):
+        if len(outputs) == len(requests):
+            break
+        time.sleep(0.01)
+    results = {x["id"]: x["result"] for x in outputs}
+
+    server._query_executor = None
+    for msg_id, (method, params) in enumerate(requests):
+        assert results[msg_id] == server[method](params)
+
+
+def test_exit_without_query_workers():
+    server = langserver.StdIOServer(io.BytesIO(), io.BytesIO(), query_workers=0)
+    server.m_exit()
+
+
+def test_import_time():
+    # startup should not pay for modules that are only needed later
+    code = ("import sys, time\n"
+            "tstart = time.perf_counter()\n"
+            "import ffi_navigator.langserver\n"
+            "print(time.perf_counter() - tstart)\n"
+            "print(' '.join(sys.modules))\n"
+            "from ffi_navigator.dialect import TVMProvider, TorchProvider\n"
+            "from ffi_navigator.dialect.base_provider import BaseProvider\n"
+            "print(issubclass(TVMProvider, BaseProvider))\n")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(langserver.__file__)), env.get("PYTHONPATH", "")])
+    costs = []
+    for _ in range(3):
+        cost, modules, is_class = subprocess.check_output(
+            [sys.executable, "-c", code], env=env).decode().splitlines()
+        costs.append(float(cost))
+    modules = modules.split()
+    for name in ["numpy", "multiprocessing", "ffi_navigator.cache",
+                 "ffi_navigator.dialect.tvm", "ffi_navigator.dialect.torch"]:
+        assert name not in modules, name
+    # the provider names are still the classes
+    assert is_class == "True"
+    # about 95ms when measured, the best of a few runs absorbs the noise
+    assert min(costs) < 0.3
+
 if __name__ == "__main__":
     # eyeballing test script
     logging.basicConfig(level=logging.INFO, format="[%(asctime)-15s] %(message)s")
@@ -381,3 +710,4 @@ if __name__ == "__main__":
     test_mxnet_dialect()
     test_dgl_dialect()
     test_taichi_dialect()
+    test_import_time()
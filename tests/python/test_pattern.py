@@ -1,3 +1,4 @@
+import pickle
 import textwrap
 from ffi_navigator import pattern, lsp
 
@@ -135,6 +136,89 @@ def test_search_symbol():
     assert(len(res)) == 1
 
 
+def test_source_buffer():
+    text = "a = 1\n\nb = f(\n  x)\n"
+    for source in [text, text.splitlines(True), text.split("\n")[:-1]]:
+        buf = pattern.SourceBuffer(source)
+        assert len(buf) == 4
+        assert buf[2].rstrip("\n") == "b = f("
+        assert buf.position(buf.text.index("x")) == lsp.Position(3, 2)
+        assert buf.line_of(0) == 0 and buf.line_of(buf.text.index("b")) == 2
+    assert pattern.SourceBuffer.wrap(buf) is buf
+    buf = pickle.loads(pickle.dumps(pattern.SourceBuffer(text.splitlines(True))))
+    assert buf.text == text and buf.lines == text.splitlines(True)
+
+    matcher = pattern.re_multi_line_matcher(
+        r"f\(\s*(?P<key>\w+)\)", lambda match, path, rg: pattern.Def(match.group("key"), path, rg))
+    items = matcher("a.py", pattern.SourceBuffer(text))
+    assert items[0].range == lsp.Range(lsp.Position(2, 4), lsp.Position(3, 4))
+
+
+def test_fused_matcher():
+    source = textwrap.dedent("""
+    TVM_REGISTER_GLOBAL("test.xyz")
+    .set_body(TestXYZ);
+
+    void Test() {
+      auto f = GetPackedFunc("test.xyz1"); auto g = GetPackedFunc("test.xyz2");
+      static constexpr const char* _type_key = "test.Node";
+    }
+    TVM_REGISTER_NODE_TYPE(TestNode)
+    .def(
+         "test.method", Method);
+    """)
+    fcreate = lambda skey, path, rg, _: pattern.Def(skey, path, rg)
+    matchers = [
+        pattern.macro_matcher(["TVM_REGISTER_GLOBAL"], fcreate),
+        pattern.func_get_searcher(["GetPackedFunc"], fcreate),
+        pattern.re_matcher(
+            r"\s*static\s+constexpr\sconst\s+char\s*\*\s+_type_key\s*=\s*\"(?P<key>[^\"]+)\"",
+            lambda match, path, rg: pattern.Def("t:" + match.group("key"), path, rg),
+            use_search=True),
+        pattern.def_matcher(["def"], fcreate),
+    ]
+    scanner = pattern.fused_matcher(matchers)
+    for lines in [source.split("\n"), source.splitlines(True)]:
+        items = list(scanner("xyz.cc", lines))
+        assert [x.key for x in items] == [
+            "test.xyz", "test.xyz1", "test.xyz2", "t:test.Node", "test.method"]
+        # same results as running the matchers one by one
+        expected = sum([matcher("xyz.cc", lines) for matcher in matchers], [])
+        assert sorted(map(str, items)) == sorted(map(str, expected))
+    # only the matches in the window are scanned
+    items = list(scanner("xyz.cc", source.split("\n"), 6, 7))
+    assert [x.key for x in items] == ["t:test.Node"]
+    # multi-line matches that overlap the window are found with the context lines
+    items = list(scanner("xyz.cc", source.split("\n"), 10, 11))
+    assert [x.key for x in items] == ["test.method"]
+    items = list(scanner("xyz.cc", source.split("\n"), 9, 10))
+    assert [x.key for x in items] == ["test.method"]
+
+
+def test_literal_prefilter():
+    matcher = pattern.func_get_searcher(
+        ["GetPackedFunc"], lambda skey, path, rg, _: pattern.Ref(skey, path, rg))
+    assert matcher.literals == ("GetPackedFunc",)
+    assert matcher("a.cc", ["int x = 1;\n", "int y = 2;\n"]) == []
+    assert matcher.stats.file_skips == 1 and matcher.stats.file_scans == 0
+
+    source = ["// GetPackedFunc is used below\n", "\n", "auto f = GetPackedFunc(\"f\");\n"]
+    items = matcher("a.cc", source)
+    assert [x.key for x in items] == ["f"]
+    assert matcher.stats.seconds > 0
+    matcher.stats.seconds = 0.0
+    assert matcher.stats == pattern.MatcherStats(
+        file_skips=1, file_scans=1, line_skips=1, line_checks=2, line_hits=1, matches=1)
+
+
+def test_find_py_names():
+    source = """
+    from . import _make
+    x = _make.Let(_make.Var("x"), y.value)
+    """
+    res = pattern.find_py_names(textwrap.dedent(source), {"_make"})
+    assert res == [("_make", 1, 14), ("_make.Let", 2, 4), ("_make.Var", 2, 14)]
+
 
 if __name__ == "__main__":
     test_find_py_imports()
@@ -143,3 +227,7 @@ if __name__ == "__main__":
     test_find_py_register_packed()
     test_find_py_register_object()
     test_search_symbol()
+    test_source_buffer()
+    test_fused_matcher()
+    test_literal_prefilter()
+    test_find_py_names()
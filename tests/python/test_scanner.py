@@ -0,0 +1,38 @@
+import os
+from ffi_navigator.scanner import scan_dir
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "w").close()
+
+
+def test_scan_dir(tmp_path):
+    root = str(tmp_path)
+    _touch(os.path.join(root, "python", "a.py"))
+    _touch(os.path.join(root, "python", "sub", "b.py"))
+    _touch(os.path.join(root, "python", ".hidden", "c.py"))
+    _touch(os.path.join(root, "src", "x.cc"))
+    _touch(os.path.join(root, "src", "x.h"))
+    _touch(os.path.join(root, "src", "readme.txt"))
+    # symlink loop
+    os.symlink(os.path.join(root, "python"), os.path.join(root, "python", "sub", "loop"))
+
+    visited = set()
+    files = scan_dir(os.path.join(root, "python"), [".py", ".cc"], visited)
+    assert [os.path.relpath(p, root) for p, _ in files[".py"]] == [
+        os.path.join("python", "a.py"), os.path.join("python", "sub", "b.py")]
+    assert files[".cc"] == []
+
+    # overlapping scan only reports the files not yet visited
+    files = scan_dir(root, [".py", ".cc", ".h"], visited)
+    assert files[".py"] == []
+    assert [os.path.basename(p) for p, _ in files[".cc"]] == ["x.cc"]
+    assert [os.path.basename(p) for p, _ in files[".h"]] == ["x.h"]
+    assert scan_dir(os.path.join(root, "missing"), [".py"]) == {".py": []}
+
+
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        test_scan_dir(tmp_dir)
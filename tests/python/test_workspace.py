@@ -1,6 +1,10 @@
+import attr
 import logging
 import os
-from ffi_navigator import workspace
+import shutil
+import time
+from ffi_navigator import cache, workspace
+from ffi_navigator.query import QueryContext, RequestCancelled
 from ffi_navigator.util import normalize_path
 
 def run_check_workspace(tvm_path):
@@ -36,6 +40,227 @@ def run_check_workspace(tvm_path):
     log_find_def(normalize_path("tvm/stmt"), "_make.LetStmt")
 
 
+curr_path = os.path.dirname(os.path.realpath(os.path.expanduser(__file__)))
+
+
+def _copy_dummy_repo(tmp_path, name):
+    root = os.path.join(str(tmp_path), name)
+    shutil.copytree(os.path.join(curr_path, "..", "dummy_repo", name), root)
+    return root
+
+
+def _index_summary(ws):
+    return ({k: len(v) for k, v in ws.key2defs.items()},
+            {k: len(v) for k, v in ws.key2refs.items()},
+            {k: len(v) for k, v in ws.modpath2exports.items()})
+
+
+def test_index_cache(tmp_path, monkeypatch):
+    tvm_path = _copy_dummy_repo(tmp_path, "tvm")
+    cache_dir = os.path.join(str(tmp_path), "cache")
+    ws = workspace.Workspace(cache_dir=cache_dir)
+    ws.initialize(tvm_path)
+    expected = _index_summary(ws)
+    assert os.listdir(cache_dir)
+
+    # restart: everything is loaded from the cache
+    ws = workspace.Workspace(cache_dir=cache_dir)
+    ws.initialize(tvm_path)
+    assert _index_summary(ws) == expected
+    make_path = os.path.join(tvm_path, "python", "tvm", "stmt.py")
+    assert ws.find_defs(make_path, "_make.LetStmt")[0].key == "make.LetStmt"
+
+    # touched but unchanged file is validated by content hash
+    api_lang = os.path.join(tvm_path, "src", "api", "api_lang.cc")
+    os.utime(api_lang, ns=(0, 0))
+    ws = workspace.Workspace(cache_dir=cache_dir)
+    ws.initialize(tvm_path)
+    assert _index_summary(ws) == expected
+
+    # changed file is extracted again
+    with open(api_lang, "a") as fo:
+        fo.write('\nTVM_REGISTER_GLOBAL("test.cache_new_key")\n')
+    ws = workspace.Workspace(cache_dir=cache_dir)
+    ws.initialize(tvm_path)
+    assert len(ws.key2defs["test.cache_new_key"]) == 1
+
+    # a deleted python file invalidates the python patterns of the other files
+    os.remove(os.path.join(tvm_path, "python", "tvm", "ir_pass.py"))
+    events = []
+    ws = workspace.Workspace(cache_dir=cache_dir,
+                             progress_callback=lambda kind, progress: events.append(progress))
+    ws.initialize(tvm_path)
+    assert "ir_pass" not in [x.key_prefix for v in ws.modpath2exports.values() for x in v]
+    num_py = len([x for x in ws._path2keys if x.endswith(".py")])
+    assert events[-1].files_extracted == num_py
+
+    # a change of the package sources discards the whole cache
+    monkeypatch.setattr(cache, "_SOURCE_DIGEST", "changed")
+    events = []
+    ws = workspace.Workspace(cache_dir=cache_dir,
+                             progress_callback=lambda kind, progress: events.append(progress))
+    ws.initialize(tvm_path)
+    assert events[-1].files_extracted == events[-1].files_indexed
+
+
+def test_reindex_doc(tmp_path):
+    tvm_path = _copy_dummy_repo(tmp_path, "tvm")
+    ws = workspace.Workspace()
+    ws.initialize(tvm_path)
+    expected = _index_summary(ws)
+
+    # update_doc replaces the previous patterns of the file
+    api_ir = os.path.join(tvm_path, "src", "api", "api_ir.cc")
+    source = open(api_ir).readlines()
+    ws.update_doc(api_ir, source)
+    assert _index_summary(ws) == expected
+
+    source = [x.replace("REGISTER_MAKE(LetStmt)", "REGISTER_MAKE(LetStmt2)") for x in source]
+    assert ws.reindex_doc(api_ir, source)
+    assert "make.LetStmt" not in ws.key2defs
+    assert ws.key2defs["make.LetStmt2"][0].range.start.line == 15
+
+    # removing and re-adding a python module restores the index
+    ir_pass = os.path.join(tvm_path, "python", "tvm", "ir_pass.py")
+    ws.remove_doc(ir_pass)
+    assert ws.find_defs(os.path.join(tvm_path, "python", "tvm", "ir_builder.py"),
+                        "_pass.Simplify") == []
+    assert ws.reindex_doc(ir_pass)
+    assert len(ws.find_defs(os.path.join(tvm_path, "python", "tvm", "ir_builder.py"),
+                            "_pass.Simplify")) == 1
+    assert not ws.reindex_doc(os.path.join(str(tmp_path), "outside.py"), [])
+
+
+def test_background_index():
+    tvm_path = os.path.join(curr_path, "..", "dummy_repo", "tvm")
+    ws = workspace.Workspace()
+    ws.initialize(tvm_path)
+    expected = _index_summary(ws)
+
+    ws = workspace.Workspace()
+    ws._chunk_size = 1
+    # files near the opened file are indexed first
+    opened = os.path.abspath(os.path.join(tvm_path, "src", "relay", "backend", "interpreter.cc"))
+    ws.prioritize(opened)
+    ws.initialize(tvm_path, background=True)
+    assert ws.wait_ready(timeout=60)
+    assert _index_summary(ws) == expected
+    first = [os.path.basename(x) for x in list(ws._path2keys.keys())[:2]]
+    assert first == ["compile_engine.cc", "interpreter.cc"]
+
+    # published snapshots are not affected by later updates
+    snapshot = ws.snapshot
+    ws.remove_doc(os.path.abspath(os.path.join(tvm_path, "src", "api", "api_ir.cc")))
+    assert "make.LetStmt" in snapshot.key2defs
+    assert "make.LetStmt" not in ws.snapshot.key2defs
+
+
+def test_parallel_extract():
+    for name in ["tvm", "pytorch"]:
+        root = os.path.join(curr_path, "..", "dummy_repo", name)
+        serial = workspace.Workspace(num_workers=1)
+        serial.initialize(root)
+        parallel = workspace.Workspace(num_workers=2)
+        parallel._parallel_min_files = 0
+        parallel.initialize(root)
+        assert _index_summary(parallel) == _index_summary(serial)
+        assert ([attr.astuple(x) for x in parallel.find_refs("make.LetStmt")] ==
+                [attr.astuple(x) for x in serial.find_refs("make.LetStmt")])
+
+
+def test_parallel_extract_many_modules(tmp_path):
+    # enough modules to split the maps of the resolver sent to the workers
+    tvm_path = _copy_dummy_repo(tmp_path, "tvm")
+    for i in range(40):
+        mod_dir = os.path.join(tvm_path, "python", "tvm", "m%d" % i)
+        os.mkdir(mod_dir)
+        with open(os.path.join(mod_dir, "__init__.py"), "w") as fo:
+            fo.write("")
+        with open(os.path.join(mod_dir, "_ffi_api.py"), "w") as fo:
+            fo.write("from .._ffi.function import _init_api\n\n"
+                     "_init_api(\"tvm.m%d\", __name__)\n" % i)
+        with open(os.path.join(mod_dir, "use.py"), "w") as fo:
+            fo.write("from . import _ffi_api\n\n\ndef run(x):\n"
+                     "    return _ffi_api.Func%d(x)\n" % i)
+        with open(os.path.join(tvm_path, "src", "m%d.cc" % i), "w") as fo:
+            fo.write("TVM_REGISTER_GLOBAL(\"m%d.Func%d\")\n"
+                     ".set_body_typed([](int x) { return x; });\n" % (i, i))
+    serial = workspace.Workspace(num_workers=1)
+    serial.initialize(tvm_path)
+    parallel = workspace.Workspace(num_workers=2)
+    parallel._parallel_min_files = 0
+    parallel.initialize(tvm_path)
+    assert _index_summary(parallel) == _index_summary(serial)
+    assert sorted(parallel.modpath2exports) == sorted(serial.modpath2exports)
+    for i in range(40):
+        key = "m%d.Func%d" % (i, i)
+        refs = [attr.astuple(x) for x in parallel.find_refs(key)]
+        assert len(refs) == 1 and refs == [attr.astuple(x) for x in serial.find_refs(key)]
+
+
+def test_index_progress():
+    tvm_path = os.path.join(curr_path, "..", "dummy_repo", "tvm")
+    events = []
+    ws = workspace.Workspace(progress_callback=lambda kind, progress: events.append((kind, progress)))
+    ws._chunk_size = 4
+    ws.initialize(tvm_path)
+    kinds = [kind for kind, _ in events]
+    assert kinds[0] == "begin" and kinds[-1] == "end"
+    assert set(kinds[1:-1]) == {"report"} and len(kinds) > 3
+    progress = events[-1][1]
+    assert progress.files_indexed == progress.files_discovered == len(ws._path2keys)
+    assert progress.files_extracted == progress.files_indexed
+    assert progress.bytes_read > 0 and progress.patterns_found > 0
+    assert events[1][1].files_indexed == 4
+
+
+def test_query_context():
+    tvm_path = os.path.join(curr_path, "..", "dummy_repo", "tvm")
+    ws = workspace.Workspace()
+    ws.initialize(tvm_path)
+    ctx = QueryContext(budget=60)
+    assert len(ws.find_refs("make.LetStmt", ctx)) == len(ws.find_refs("make.LetStmt"))
+    assert not ctx.partial
+
+    ctx = QueryContext(budget=0)
+    time.sleep(0.01)
+    assert ws.find_refs("make.LetStmt", ctx) == []
+    assert ctx.partial
+
+    ctx = QueryContext()
+    ctx.cancel()
+    try:
+        ws.find_refs("make.LetStmt", ctx)
+        assert False
+    except RequestCancelled:
+        pass
+
+
+def test_stats():
+    root = os.path.join(curr_path, "..", "dummy_repo", "tvm")
+    serial = workspace.Workspace(num_workers=1)
+    serial.initialize(root)
+    stats = serial.stats()
+    assert stats["dialects"] == ["tvm"]
+    assert stats["files"] == len(serial._path2keys)
+    counts = stats["counts"]
+    assert counts["defs"] == serial.key2defs.num_items() > 0
+    assert counts["refs"] == serial.key2refs.num_items() > 0
+    assert counts["exports"] > 0 and counts["modules"] > 0
+    assert all(size > 0 for size in stats["memory"].values())
+    matchers = stats["matchers"]["tvm"]
+    assert sum(x["matches"] for x in matchers.values()) > 0
+    assert all(x["seconds"] >= 0 for x in matchers.values())
+
+    # the counters of the worker processes are merged
+    parallel = workspace.Workspace(num_workers=2)
+    parallel._parallel_min_files = 0
+    parallel.initialize(root)
+    for name, value in parallel.stats()["matchers"]["tvm"].items():
+        assert value["matches"] == matchers[name]["matches"]
+        assert value["line_checks"] == matchers[name]["line_checks"]
+
+
 if __name__ == "__main__":
     # eyeballing test script
     logging.basicConfig(level=logging.INFO, format="[%(asctime)-15s] %(message)s")